@@ -0,0 +1,650 @@
+"""
+Benchmarks for Life Pattern Analyzer.
+
+Upstreams are simulated in-process with a fixed latency, so results measure
+our own serving overhead and concurrency rather than the public APIs.
+
+    python benchmark.py serving --latency 0.2 --requests 200 --concurrency 100
+    python benchmark.py model --iterations 20000
+    python benchmark.py engine --sizes 1,1000,100000
+
+    python benchmark.py suite --latencies 0,0.05 --output bench.json
+    python benchmark.py compare baseline.json bench.json --threshold 10
+
+    CAPTURE_FILE=capture.jsonl.gz gunicorn life_pattern_analyzer:app   # record real traffic
+    python benchmark.py replay capture.jsonl.gz --speed 10
+"""
+
+import argparse
+import asyncio
+import contextvars
+import gzip
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    import httpx    # optional - only the ASGI benchmarks need it
+except ImportError:
+    httpx = None
+import requests
+from requests.adapters import BaseAdapter
+
+# Measure the server, not the real upstreams' quotas or our own per-client limits
+os.environ.setdefault('UPSTREAM_QUOTAS', '')
+os.environ.setdefault('ADMISSION_MAX_CONCURRENT', '0')
+
+import life_pattern_analyzer as lpa
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SIMULATED UPSTREAMS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def canned_payload(path):
+    """A realistic-looking body for each upstream endpoint"""
+    if path.startswith('/v1/forecast'):
+        return {'current': {'temperature_2m': 19.4, 'relative_humidity_2m': 61, 'weather_code': 1,
+                            'wind_speed_10m': 11.2, 'pressure_msl': 1016.3}}
+    if path.startswith('/v1/search'):
+        return {'results': [{'name': 'Paris', 'country': 'France', 'latitude': 48.85,
+                             'longitude': 2.35, 'timezone': 'Europe/Paris'}]}
+    return {'city': 'Paris', 'country': 'France', 'lat': 48.85, 'lon': 2.35,
+            'timezone': 'Europe/Paris', 'isp': 'Example ISP'}
+
+class SimulatedAdapter(BaseAdapter):
+    """requests transport adapter that sleeps for a fixed latency, then answers"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        time.sleep(self.latency)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(canned_payload(request.path_url)).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def simulate_upstreams(latency):
+    """Point both the sync sessions and the async clients at the simulated upstreams"""
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=canned_payload(request.url.path))
+
+    for client in lpa.UPSTREAMS.values():
+        client.session.mount('http://', SimulatedAdapter(latency))
+        client.session.mount('https://', SimulatedAdapter(latency))
+        client.async_client = lambda: _mock_client(handler)
+
+_mock_clients = {}
+
+def _mock_client(handler):
+    loop = asyncio.get_running_loop()
+    if loop not in _mock_clients:
+        _mock_clients[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return _mock_clients[loop]
+
+def request_body(i):
+    """GPS request in a distinct weather cell, so every request is a cache miss"""
+    return {'lat': -60 + (i % 1200) * 0.1, 'lon': 10 + (i // 1200) * 0.1, 'city': 'Bench'}
+
+def reset_caches():
+    lpa.weather_cache.clear()
+    lpa.geocode_cache.clear()
+    lpa.response_cache.clear()
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SERVING MODES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def bench_wsgi(n):
+    """One gunicorn sync worker: requests are served strictly one after another"""
+    client = lpa.app.test_client()
+    start = time.perf_counter()
+    for i in range(n):
+        assert client.post('/api/analyze', json=request_body(i)).status_code == 200
+    return time.perf_counter() - start
+
+async def _asgi_request(i):
+    body = json.dumps(request_body(i)).encode()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/api/analyze', 'headers': [],
+             'query_string': b''}
+    await lpa.asgi_app(scope, receive, send)
+    assert sent[0]['status'] == 200
+
+async def _bench_asgi(n, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await _asgi_request(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - start
+
+def bench_asgi(n, concurrency):
+    """One event-loop worker holding up to `concurrency` requests in flight"""
+    return asyncio.run(_bench_asgi(n, concurrency))
+
+def run_serving(args):
+    simulate_upstreams(args.latency)
+    results = {}
+
+    reset_caches()
+    elapsed = bench_wsgi(args.requests)
+    results['wsgi_sync'] = {'requests': args.requests, 'seconds': round(elapsed, 3),
+                            'rps_per_worker': round(args.requests / elapsed, 1)}
+
+    reset_caches()
+    elapsed = bench_asgi(args.requests, args.concurrency)
+    results['asgi'] = {'requests': args.requests, 'concurrency': args.concurrency,
+                       'seconds': round(elapsed, 3),
+                       'rps_per_worker': round(args.requests / elapsed, 1)}
+
+    results['speedup'] = round(results['asgi']['rps_per_worker'] / results['wsgi_sync']['rps_per_worker'], 1)
+    results['upstream_latency_s'] = args.latency
+    print(json.dumps(results, indent=2))
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODEL
+# ══════════════════════════════════════════════════════════════════════════════
+
+MODEL_WEATHER = {'temperature': 21.0, 'humidity': 55, 'wind_speed': 8.0, 'pressure': 1015, 'condition': 'Clear sky'}
+MODEL_LOCATION = {'city': 'Paris', 'country': 'France', 'lat': 48.85, 'lon': 2.35, 'timezone': 'Europe/Paris'}
+
+def uncached_analysis(weather, moon, circadian, location):
+    """The pre-memoization path: recompute all 24 rows and every insight"""
+    weather_factor, temp_factor = lpa.environment_factors(weather)
+    predictions = lpa.compute_hourly_predictions(weather_factor, temp_factor, moon['influence'],
+                                                 lpa.datetime.now().hour)
+    return predictions, lpa.generate_insights(predictions, weather, moon, location)
+
+def run_model(args):
+    moon = lpa.get_moon_phase()
+    circadian = lpa.calculate_circadian_rhythm()
+    call = (MODEL_WEATHER, moon, circadian, MODEL_LOCATION)
+
+    results = {}
+    for name, fn in (('computed', uncached_analysis), ('memoized', lpa.analyze_productivity_pattern)):
+        seconds = min(timeit.repeat(lambda: fn(*call), number=args.iterations, repeat=3))
+        results[name] = {'us_per_call': round(seconds / args.iterations * 1e6, 2)}
+    results['speedup'] = round(results['computed']['us_per_call'] / results['memoized']['us_per_call'], 1)
+    print(json.dumps(results, indent=2))
+
+def engine_inputs(n, seed=7):
+    """n random location-days drawn from the model's real input domain"""
+    rng = random.Random(seed)
+    influences = list(lpa.MOON_INFLUENCE.values())
+    return [(rng.choice((1.0, 1.1, 0.9, 0.7)), rng.choice((1.0, 1.1, 0.85)),
+             rng.choice(influences), rng.randrange(24)) for _ in range(n)]
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run_engine(args):
+    results = {}
+    for n in (int(size) for size in args.sizes.split(',')):
+        entities = engine_inputs(n)
+        columns = list(zip(*((wf, tf, inf['focus'], inf['creativity'], inf['social'], start)
+                             for wf, tf, inf, start in entities)))
+        timings = {
+            'scalar': _timed(lambda: lpa.predict_many(entities, engine='scalar')),
+            'numpy_rows': _timed(lambda: lpa.predict_many(entities, engine='numpy')),
+            'numpy_arrays': _timed(lambda: lpa.predict_matrix(*columns)),
+        }
+        results[n] = {name: {'seconds': round(t, 4), 'location_days_per_s': round(n / t)}
+                      for name, t in timings.items()}
+    print(json.dumps(results, indent=2))
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SUITE - reproducible micro + end-to-end results as JSON, with regression checks
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _stats_us(samples):
+    """Summary of per-call timings (seconds) in microseconds"""
+    samples = sorted(samples)
+    return {
+        'median_us': round(statistics.median(samples) * 1e6, 2),
+        'min_us': round(samples[0] * 1e6, 2),
+        'p95_us': round(samples[int(len(samples) * 0.95) - 1] * 1e6, 2),
+        'samples': len(samples),
+    }
+
+def microbench(fn, number, repeat):
+    """Per-call time of fn over `repeat` rounds of `number` calls"""
+    fn()  # warm-up
+    return _stats_us([t / number for t in timeit.repeat(fn, number=number, repeat=repeat)])
+
+def micro_suite(args):
+    moon = lpa.get_moon_phase()
+    circadian = lpa.calculate_circadian_rhythm()
+    weather_factor, temp_factor = lpa.environment_factors(MODEL_WEATHER)
+    predictions = lpa.compute_hourly_predictions(weather_factor, temp_factor, moon['influence'], 9)
+    cases = {
+        'get_moon_phase': lpa.get_moon_phase,
+        'calculate_circadian_rhythm': lpa.calculate_circadian_rhythm,
+        'analyze_productivity_pattern':
+            lambda: lpa.analyze_productivity_pattern(MODEL_WEATHER, moon, circadian, MODEL_LOCATION),
+        'generate_insights':
+            lambda: lpa.generate_insights(predictions, MODEL_WEATHER, moon, MODEL_LOCATION),
+    }
+    return {f'micro/{name}': microbench(fn, args.number, args.repeat) for name, fn in cases.items()}
+
+E2E_SCENARIOS = {
+    # name: (request body for request i, whether to clear caches before every request)
+    'gps_cold': (request_body, True),
+    'gps_warm': (lambda i: {'lat': 48.85, 'lon': 2.35, 'city': 'Paris'}, False),
+    'city_warm': (lambda i: {'city': 'Paris'}, False),
+    'ip_cold': (lambda i: {}, True),
+}
+
+def e2e_suite(args):
+    results = {}
+    client = lpa.app.test_client()
+    for latency in (float(x) for x in args.latencies.split(',')):
+        simulate_upstreams(latency)
+        for name, (body, cold) in E2E_SCENARIOS.items():
+            reset_caches()
+            client.post('/api/analyze', json=body(0))  # warm-up (and cache fill for *_warm)
+            samples = []
+            for i in range(args.requests):
+                if cold:
+                    reset_caches()
+                started = time.perf_counter()
+                response = client.post('/api/analyze', json=body(i))
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.data
+            results[f'e2e/{name}@{int(latency * 1000)}ms'] = _stats_us(samples)
+    return results
+
+def suite_meta(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'engine': lpa.PREDICTION_ENGINE,
+        'seed': args.seed,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def run_suite(args):
+    # Fixed seed so random tips and generated inputs are identical between runs
+    random.seed(args.seed)
+    lpa.UPSTREAM_BACKOFF = 0
+    results = {}
+    if args.only in ('all', 'micro'):
+        results.update(micro_suite(args))
+    if args.only in ('all', 'e2e'):
+        results.update(e2e_suite(args))
+    report = {'meta': suite_meta(args), 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+def run_compare(args):
+    """Flag every benchmark whose chosen statistic got slower than the threshold allows"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name][args.metric], current[name][args.metric]
+        change = (after - before) / before * 100 if before else 0.0
+        status = 'REGRESSION' if change > args.threshold else ('improved' if change < -args.threshold else 'ok')
+        regressions += status == 'REGRESSION'
+        print(f'{status:<11} {name:<45} {before:>12.2f}us -> {after:>12.2f}us  ({change:+.1f}%)')
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f"{'missing':<11} {name}  (only in {'baseline' if name in baseline else 'current'})")
+    sys.exit(1 if regressions else 0)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REPLAY - captured traffic (CAPTURE_FILE) back through the app, upstreams from the log
+# ══════════════════════════════════════════════════════════════════════════════
+
+VOLATILE_FIELDS = 'timestamp,tip,profile'
+
+# The capture record being replayed in this thread/task, and its original wall-clock time
+replaying = contextvars.ContextVar('replaying', default=None)
+
+class CapturedClock(datetime):
+    """datetime whose now() is the replayed request's original time, so time-of-day output matches"""
+
+    @classmethod
+    def now(cls, tz=None):
+        record = replaying.get()
+        if record is None:
+            return datetime.now(tz)
+        return datetime.fromtimestamp(record['t'], tz)
+
+def read_capture(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def exchange_key(upstream, path, params):
+    """Identify an upstream call the way it goes over the wire: all values stringified"""
+    return upstream, path, tuple(sorted((k, str(v)) for k, v in params))
+
+class CapturedUpstreams:
+    """Answer upstream calls from the capture: the replayed request's own exchanges first, then the latest
+    answer any request got for the same call (caches may miss where the original run hit)"""
+
+    def __init__(self, records, latency_scale):
+        self.latency_scale = latency_scale
+        self.index = {}
+        self.served = 0
+        self.unmatched = 0
+        self._clients = {}
+        for record in records:
+            record['_exchanges'] = {}
+            for ex in record['upstream']:
+                key = exchange_key(ex['upstream'], ex['path'], ex['params'].items())
+                record['_exchanges'][key] = ex
+                self.index[key] = ex
+
+    def lookup(self, upstream, path, params):
+        key = exchange_key(upstream, path, params)
+        record = replaying.get()
+        ex = (record or {}).get('_exchanges', {}).get(key) or self.index.get(key)
+        if ex is None:
+            self.unmatched += 1
+            return 404, {'error': True, 'reason': 'not in capture'}, 0.0
+        self.served += 1
+        delay = ex['ms'] / 1000 * self.latency_scale
+        if 'error' in ex:
+            return 400, {'error': True, 'reason': ex['error']}, delay   # 4xx: fails without retrying
+        return 200, ex['data'], delay
+
+    def install(self):
+        """Serve every upstream client, sync and async, from the capture"""
+        for name, client in lpa.UPSTREAMS.items():
+            adapter = CapturedAdapter(self, name)
+            client.session.mount('http://', adapter)
+            client.session.mount('https://', adapter)
+            client.async_client = lambda name=name: self.async_client(name)
+
+    def async_client(self, name):
+        key = (asyncio.get_running_loop(), name)
+        if key not in self._clients:
+            async def handler(request):
+                status, data, delay = self.lookup(name, request.url.path, request.url.params.multi_items())
+                await asyncio.sleep(delay)
+                return httpx.Response(status, json=data)
+            self._clients[key] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return self._clients[key]
+
+class CapturedAdapter(BaseAdapter):
+    def __init__(self, upstreams, name):
+        super().__init__()
+        self.upstreams = upstreams
+        self.name = name
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        status, data, delay = self.upstreams.lookup(self.name, url.path, parse_qsl(url.query))
+        time.sleep(delay)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def flatten(value, prefix=''):
+    """{'a': {'b': [1]}} -> {'a.b[0]': 1}"""
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f'{prefix}.{key}' if prefix else key))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, item in enumerate(value):
+            items.update(flatten(item, f'{prefix}[{i}]'))
+        return items
+    return {prefix: value}
+
+def response_diff(before, after, ignore):
+    """Paths whose values differ between two responses, skipping ignored top-level fields"""
+    before = flatten({k: v for k, v in (before or {}).items() if k not in ignore})
+    after = flatten({k: v for k, v in (after or {}).items() if k not in ignore})
+    return sorted(path for path in before.keys() | after.keys() if before.get(path) != after.get(path))
+
+def _latency_ms(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    pick = lambda p: round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 2)
+    return {'count': len(samples), 'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99),
+            'max_ms': round(samples[-1] * 1000, 2)}
+
+def replay_schedule(records, speed):
+    """Offsets (s) from the start at which to send each record: original gaps / speed, or 0 for as-fast-as-possible"""
+    if not speed:
+        return [0.0] * len(records)
+    first = records[0]['t']
+    return [(record['t'] - first) / speed for record in records]
+
+def replay_wsgi(records, offsets, concurrency, paced):
+    local = threading.local()
+
+    def one(record, scheduled):
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if not paced:
+            scheduled = time.perf_counter()   # closed loop: time the request itself, not its queueing
+        if not hasattr(local, 'client'):
+            local.client = lpa.app.test_client()
+        token = replaying.set(record)
+        try:
+            response = local.client.post('/api/analyze', json=record['body'])
+            return response.status_code, response.get_json(silent=True), time.perf_counter() - scheduled
+        finally:
+            replaying.reset(token)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(one, record, start + offset) for record, offset in zip(records, offsets)]
+        return [future.result() for future in futures]
+
+async def _replay_asgi(records, offsets, concurrency, paced):
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def one(record, offset):
+        await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+        scheduled = start + offset
+        async with semaphore:
+            if not paced:
+                scheduled = time.perf_counter()
+            replaying.set(record)    # each gathered coroutine runs in its own task context
+            messages = [{'type': 'http.request', 'body': json.dumps(record['body']).encode(), 'more_body': False}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'POST', 'path': '/api/analyze', 'headers': [],
+                     'query_string': b''}
+            await lpa.asgi_app(scope, receive, send)
+            body = json.loads(sent[1]['body'])
+            return sent[0]['status'], body, time.perf_counter() - scheduled
+
+    return await asyncio.gather(*(one(record, offset) for record, offset in zip(records, offsets)))
+
+def run_replay(args):
+    records = []
+    for path in args.captures:
+        records.extend(read_capture(path))
+    records.sort(key=lambda record: record['t'])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        sys.exit('No captured requests to replay')
+
+    random.seed(args.seed)
+    lpa.UPSTREAM_BACKOFF = 0
+    lpa.CAPTURE_FILE = ''            # never re-capture the replay itself
+    lpa.weather_refresher.workers = 0
+    reset_caches()
+    upstreams = CapturedUpstreams(records, args.upstream_latency)
+    upstreams.install()
+    if args.clock == 'captured':
+        lpa.datetime = CapturedClock
+
+    offsets = replay_schedule(records, args.speed)
+    started = time.perf_counter()
+    if args.mode == 'asgi':
+        results = asyncio.run(_replay_asgi(records, offsets, args.concurrency, bool(args.speed)))
+    else:
+        results = replay_wsgi(records, offsets, args.concurrency, bool(args.speed))
+    elapsed = time.perf_counter() - started
+
+    ignore = set(filter(None, args.ignore.split(',')))
+    by_kind, diff_paths = {}, {}
+    status_changed = differing = 0
+    examples = []
+    for record, (status, body, latency) in zip(records, results):
+        by_kind.setdefault(record['kind'], []).append(latency)
+        status_changed += status != record['status']
+        paths = response_diff(record['response'], body, ignore)
+        differing += bool(paths)
+        for path in paths:
+            diff_paths[path] = diff_paths.get(path, 0) + 1
+        if paths and len(examples) < args.examples:
+            examples.append({'body': record['body'], 'paths': paths[:10]})
+
+    report = {
+        'requests': len(records),
+        'mode': args.mode,
+        'speed': args.speed,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(records) / elapsed, 1),
+        'latency': {
+            'replayed': _latency_ms([latency for _, _, latency in results]),
+            'captured': _latency_ms([record['ms'] / 1000 for record in records]),
+            'by_kind': {kind: _latency_ms(samples) for kind, samples in sorted(by_kind.items())},
+        },
+        'upstream': {'served_from_capture': upstreams.served, 'unmatched': upstreams.unmatched},
+        'diff': {
+            'ignored': sorted(ignore),
+            'status_changed': status_changed,
+            'responses_differing': differing,
+            'paths': dict(sorted(diff_paths.items(), key=lambda item: -item[1])[:args.top]),
+            'examples': examples,
+        },
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+# Optional packages a command needs, from requirements-extras.txt
+EXTRAS = {'serving': 'httpx', 'engine': 'numpy'}
+
+def main():
+    parser = argparse.ArgumentParser(description='Life Pattern Analyzer benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serving = sub.add_parser('serving', help='WSGI sync worker vs ASGI worker throughput')
+    serving.add_argument('--latency', type=float, default=0.2, help='simulated upstream latency (s)')
+    serving.add_argument('--requests', type=int, default=200)
+    serving.add_argument('--concurrency', type=int, default=100)
+    serving.set_defaults(run=run_serving)
+
+    model = sub.add_parser('model', help='memoized prediction table vs recomputing every request')
+    model.add_argument('--iterations', type=int, default=20000)
+    model.set_defaults(run=run_model)
+
+    engine = sub.add_parser('engine', help='scalar vs numpy scoring throughput by location-days')
+    engine.add_argument('--sizes', default='1,1000,100000')
+    engine.set_defaults(run=run_engine)
+
+    suite = sub.add_parser('suite', help='micro + end-to-end benchmarks as machine-readable JSON')
+    suite.add_argument('--only', choices=('all', 'micro', 'e2e'), default='all')
+    suite.add_argument('--latencies', default='0,0.05', help='comma-separated simulated upstream latencies (s)')
+    suite.add_argument('--requests', type=int, default=50, help='end-to-end requests per scenario')
+    suite.add_argument('--number', type=int, default=2000, help='calls per micro-benchmark round')
+    suite.add_argument('--repeat', type=int, default=7, help='micro-benchmark rounds')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--output', help='also write the JSON report to this file')
+    suite.set_defaults(run=run_suite)
+
+    compare = sub.add_parser('compare', help='compare two suite reports, exit 1 on regressions')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=10, help='allowed slowdown in percent')
+    compare.add_argument('--metric', choices=('median_us', 'min_us', 'p95_us'), default='median_us')
+    compare.set_defaults(run=run_compare)
+
+    replay = sub.add_parser('replay', help='replay captured /api/analyze traffic with upstreams served from the capture')
+    replay.add_argument('captures', nargs='+', help='CAPTURE_FILE logs (.jsonl or .jsonl.gz)')
+    replay.add_argument('--speed', type=float, default=0,
+                        help='1 = original pacing, N = N times faster, 0 = as fast as possible')
+    replay.add_argument('--mode', choices=('wsgi', 'asgi'), default='wsgi')
+    replay.add_argument('--concurrency', type=int, default=16)
+    replay.add_argument('--upstream-latency', type=float, default=1.0,
+                        help='scale for the captured upstream latencies (0 = instant)')
+    replay.add_argument('--clock', choices=('captured', 'live'), default='captured',
+                        help="run each request at its captured time of day, or now")
+    replay.add_argument('--ignore', default=VOLATILE_FIELDS, help='top-level response fields left out of diffs')
+    replay.add_argument('--limit', type=int, help='replay only the first N requests')
+    replay.add_argument('--top', type=int, default=20, help='differing paths to list')
+    replay.add_argument('--examples', type=int, default=3, help='differing requests to show')
+    replay.add_argument('--seed', type=int, default=0)
+    replay.add_argument('--output', help='also write the JSON report to this file')
+    replay.set_defaults(run=run_replay)
+
+    args = parser.parse_args()
+    needed = 'httpx' if args.command == 'replay' and args.mode == 'asgi' else EXTRAS.get(args.command)
+    if needed and importlib.util.find_spec(needed) is None:
+        parser.error(f'benchmark.py {args.command} needs {needed}: pip install -r requirements-extras.txt')
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
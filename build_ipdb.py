@@ -0,0 +1,31 @@
+"""
+Compile an IP-range CSV into the memory-mapped format IP_DB_FILE loads instantly.
+
+    python build_ipdb.py dbip-city-lite-2026-10.csv.gz ipdb.bin
+    IP_DB_FILE=ipdb.bin gunicorn life_pattern_analyzer:app
+
+Rows are start,end,continent,country,region,city,latitude,longitude[,timezone] -
+the DB-IP "IP to City Lite" CSV works as-is. Without a timezone column the zone is
+estimated per lookup from the coordinates. The output is replaced atomically,
+so running this over the live file is picked up by workers on their next check.
+"""
+
+import argparse
+import time
+
+from life_pattern_analyzer import IPDatabase
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile an IP-range CSV for IP_DB_FILE')
+    parser.add_argument('csv', help='CSV (optionally .gz) of IP ranges')
+    parser.add_argument('output', help='compiled database to write')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    db = IPDatabase.from_csv(args.csv)
+    db.save(args.output)
+    print(f'{len(db.v4_locs)} IPv4 + {len(db.v6_locs)} IPv6 ranges, {len(db.locations)} locations '
+          f'-> {args.output} in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Local stand-in for the upstream APIs, for load testing without rate limits.
+
+Serves ip-api.com (/json/), Open-Meteo forecast (/v1/forecast), Open-Meteo
+geocoding (/v1/search) and Nominatim reverse geocoding (/reverse) from one
+port, with configurable latency distributions, error and timeout rates.
+
+    python fake_upstream.py --port 8900 --latency lognormal:80,0.5 --error-rate 0.02
+
+Then point the app at it:
+
+    IP_API_URL=http://127.0.0.1:8900 OPEN_METEO_URL=http://127.0.0.1:8900 \\
+    GEOCODING_URL=http://127.0.0.1:8900 NOMINATIM_URL=http://127.0.0.1:8900 gunicorn life_pattern_analyzer:app
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CITIES = [
+    # name, country, admin1, lat, lon, timezone
+    ('London', 'United Kingdom', 'England', 51.5085, -0.1257, 'Europe/London'),
+    ('Paris', 'France', 'Île-de-France', 48.8534, 2.3488, 'Europe/Paris'),
+    ('Berlin', 'Germany', 'Berlin', 52.5244, 13.4105, 'Europe/Berlin'),
+    ('New York', 'United States', 'New York', 40.7143, -74.006, 'America/New_York'),
+    ('San Francisco', 'United States', 'California', 37.7749, -122.4194, 'America/Los_Angeles'),
+    ('Calgary', 'Canada', 'Alberta', 51.0501, -114.0853, 'America/Edmonton'),
+    ('Toronto', 'Canada', 'Ontario', 43.7001, -79.4163, 'America/Toronto'),
+    ('Tokyo', 'Japan', 'Tokyo', 35.6895, 139.6917, 'Asia/Tokyo'),
+    ('Sydney', 'Australia', 'New South Wales', -33.8679, 151.2073, 'Australia/Sydney'),
+    ('Mumbai', 'India', 'Maharashtra', 19.0728, 72.8826, 'Asia/Kolkata'),
+    ('São Paulo', 'Brazil', 'São Paulo', -23.5475, -46.6361, 'America/Sao_Paulo'),
+    ('Cape Town', 'South Africa', 'Western Cape', -33.9258, 18.4232, 'Africa/Johannesburg'),
+]
+
+WEATHER_CODES = [0, 0, 1, 1, 2, 3, 45, 51, 61, 63, 65, 71, 95]
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FAULT MODEL
+# ══════════════════════════════════════════════════════════════════════════════
+
+def parse_latency(spec):
+    """'fixed:MS', 'uniform:MIN_MS,MAX_MS', 'normal:MEAN_MS,SD_MS' or 'lognormal:MEDIAN_MS,SIGMA' -> sampler (s)"""
+    kind, _, args = spec.partition(':')
+    values = [float(x) for x in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if kind == 'lognormal':
+        return lambda rng: values[0] * math.exp(rng.gauss(0, values[1])) / 1000
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+class FaultModel:
+    """Decides, per request, how long to wait and whether to fail or hang"""
+
+    def __init__(self, latency='fixed:50', error_rate=0.0, timeout_rate=0.0, hang_seconds=30, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def decide(self, route):
+        with self.lock:
+            roll = self.rng.random()
+            delay = self.sample_latency(self.rng)
+            outcome = 'timeout' if roll < self.timeout_rate else (
+                'error' if roll < self.timeout_rate + self.error_rate else 'ok')
+            key = f'{route}:{outcome}'
+            self.counts[key] = self.counts.get(key, 0) + 1
+        return outcome, (self.hang_seconds if outcome == 'timeout' else delay)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PAYLOADS - shaped like the real APIs, deterministic per coordinate
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _seeded(*parts):
+    return random.Random(zlib.crc32(repr(parts).encode()))
+
+def forecast_one(lat, lon, query):
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    rng = _seeded(round(lat, 2), round(lon, 2), hour.isoformat())
+    base_temp = 28 - abs(lat) * 0.45 + rng.uniform(-6, 6)
+    data = {
+        'latitude': lat, 'longitude': lon, 'generationtime_ms': 0.05,
+        'utc_offset_seconds': 0, 'timezone': 'GMT', 'timezone_abbreviation': 'GMT', 'elevation': 35.0,
+    }
+    if 'current' in query:
+        data['current_units'] = {'time': 'iso8601', 'interval': 'seconds', 'temperature_2m': '°C',
+                                 'relative_humidity_2m': '%', 'weather_code': 'wmo code',
+                                 'wind_speed_10m': 'km/h', 'pressure_msl': 'hPa'}
+        data['current'] = {
+            'time': hour.strftime('%Y-%m-%dT%H:%M'), 'interval': 900,
+            'temperature_2m': round(base_temp, 1),
+            'relative_humidity_2m': rng.randint(30, 95),
+            'weather_code': rng.choice(WEATHER_CODES),
+            'wind_speed_10m': round(rng.uniform(0, 35), 1),
+            'pressure_msl': round(rng.uniform(995, 1030), 1),
+        }
+    if 'hourly' in query:
+        hours = int(query.get('forecast_hours', ['168'])[0])
+        data['hourly_units'] = {'time': 'iso8601', 'temperature_2m': '°C',
+                                'relative_humidity_2m': '%', 'weather_code': 'wmo code'}
+        data['hourly'] = {
+            'time': [(hour + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M') for i in range(hours)],
+            'temperature_2m': [round(base_temp + 4 * math.sin((i - 9) * math.pi / 12), 1) for i in range(hours)],
+            'relative_humidity_2m': [rng.randint(30, 95) for _ in range(hours)],
+            'weather_code': [rng.choice(WEATHER_CODES) for _ in range(hours)],
+        }
+    return data
+
+def forecast(query):
+    lats = [float(x) for x in query['latitude'][0].split(',')]
+    lons = [float(x) for x in query['longitude'][0].split(',')]
+    results = [forecast_one(lat, lon, query) for lat, lon in zip(lats, lons)]
+    return results[0] if len(results) == 1 else results
+
+def geocode(query):
+    name = query.get('name', [''])[0].strip().casefold()
+    count = int(query.get('count', ['10'])[0])
+    matches = [c for c in CITIES if c[0].casefold().startswith(name)] if name else []
+    if not matches:
+        return {'generationtime_ms': 0.2}
+    return {'results': [
+        {'id': i, 'name': n, 'latitude': lat, 'longitude': lon, 'country': country,
+         'admin1': admin1, 'timezone': tz}
+        for i, (n, country, admin1, lat, lon, tz) in enumerate(matches[:count])
+    ], 'generationtime_ms': 0.2}
+
+def ip_location(ip):
+    name, country, admin1, lat, lon, tz = _seeded(ip).choice(CITIES)
+    return {'status': 'success', 'country': country, 'regionName': admin1, 'city': name,
+            'lat': lat, 'lon': lon, 'timezone': tz, 'isp': 'Fake ISP', 'query': ip or '203.0.113.7'}
+
+def reverse(query):
+    lat, lon = float(query['lat'][0]), float(query['lon'][0])
+    name, country, admin1, *_ = min(CITIES, key=lambda c: (c[3] - lat) ** 2 + (c[4] - lon) ** 2)
+    return {'lat': str(lat), 'lon': str(lon),
+            'address': {'city': name, 'state': admin1, 'country': country}}
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SERVER
+# ══════════════════════════════════════════════════════════════════════════════
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real APIs
+    faults = FaultModel()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/__stats':
+            return self._reply(200, self.faults.counts)
+
+        if url.path.startswith('/json'):
+            route, build = 'ip', lambda: ip_location(url.path[len('/json/'):])
+        elif url.path == '/v1/forecast':
+            route, build = 'forecast', lambda: forecast(query)
+        elif url.path == '/v1/search':
+            route, build = 'search', lambda: geocode(query)
+        elif url.path == '/reverse':
+            route, build = 'reverse', lambda: reverse(query)
+        else:
+            return self._reply(404, {'error': True, 'reason': 'Not found'})
+
+        outcome, delay = self.faults.decide(route)
+        time.sleep(delay)
+        if outcome == 'error':
+            return self._reply(503, {'error': True, 'reason': 'Injected failure'})
+        try:
+            return self._reply(200, build())
+        except (KeyError, ValueError) as e:
+            return self._reply(400, {'error': True, 'reason': f'Bad request: {e}'})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # the client gave up (e.g. an injected timeout)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=8900, host='127.0.0.1', **fault_options):
+    """Start the fake upstream server on a background thread and return it"""
+    FakeUpstreamHandler.faults = FaultModel(**fault_options)
+    server = ThreadingHTTPServer((host, port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake ip-api / Open-Meteo / Nominatim server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', default='fixed:50',
+                        help='fixed:MS | uniform:MIN,MAX | normal:MEAN,SD | lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction answered with HTTP 503')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction that hang past client timeouts')
+    parser.add_argument('--hang-seconds', type=float, default=30)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    serve(args.port, args.host, latency=args.latency, error_rate=args.error_rate,
+          timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds, seed=args.seed)
+    base = f'http://{args.host}:{args.port}'
+    print(f'Fake upstreams on {base} (stats at {base}/__stats)')
+    print(f'  export IP_API_URL={base} OPEN_METEO_URL={base} GEOCODING_URL={base}')
+    print("  export UPSTREAM_QUOTAS=''   # lift the real APIs' quotas, unless you're testing them")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -12,121 +12,1909 @@
 ╚═══════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 import requests
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timedelta, timezone
+import asyncio
+import atexit
+import cProfile
+import csv
+import functools
+import gzip
+import heapq
+import hmac
+import io
+import ipaddress
 import json
+import logging
 import math
+import mmap
+import os
 import random
+import re
+import sqlite3
+import pstats
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import unicodedata
+import zlib
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+    import httpx    # optional - only the ASGI serving mode needs it
+except ImportError:
+    httpx = None
+
+try:
+    import numpy as np  # optional - only the vectorized prediction engine needs it
+except ImportError:
+    np = None
+
+try:
+    import fcntl    # POSIX only - elsewhere cache snapshots are merged without a file lock
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 # ══════════════════════════════════════════════════════════════════════════════
-# REAL DATA SOURCES - All working without API keys!
+# METRICS - Prometheus text format, served at /metrics
 # ══════════════════════════════════════════════════════════════════════════════
 
-def get_ip_location():
-    """Get user's location from IP - No API key needed!"""
+METRICS = []              # registered Counter/Gauge/Histogram instances
+METRIC_COLLECTORS = []    # callables returning [(name, type, help, [(labels, value)])] at scrape time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter:
+    """Monotonic counter with fixed label names"""
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', dict(zip(self.labels, labels)), value) for labels, value in self._values.items()]
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    type = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(Counter):
+    """Bucketed observations plus _sum and _count"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for labels, series in self._values.items():
+                labels = dict(zip(self.labels, labels))
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    out.append(('_bucket', dict(labels, le=str(bound)), cumulative))
+                out.append(('_sum', labels, series[-1]))
+                out.append(('_count', labels, cumulative))
+        return out
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_samples(name, type, help, samples):
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+    for suffix, labels, value in samples:
+        label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f'{name}{suffix}{{{label_text}}} {value}' if label_text else f'{name}{suffix} {value}')
+    return lines
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines += _format_samples(metric.name, metric.type, metric.help, metric.samples())
+    for collect in METRIC_COLLECTORS:
+        for name, type, help, samples in collect():
+            lines += _format_samples(name, type, help, [('', labels, value) for labels, value in samples])
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('lpa_stage_seconds', 'Time spent in each stage of a request', ('stage',))
+UPSTREAM_REQUESTS = Counter('lpa_upstream_requests_total', 'Upstream HTTP attempts by outcome', ('upstream', 'outcome'))
+UPSTREAM_SECONDS = Histogram('lpa_upstream_seconds', 'Upstream HTTP attempt latency', ('upstream',))
+FALLBACKS = Counter('lpa_fallbacks_total', 'Responses that used built-in fallback data', ('component',))
+GEOCODES = Counter('lpa_geocode_lookups_total', 'City lookups by where they were answered', ('source',))
+REQUESTS_TOTAL = Counter('lpa_requests_total', 'HTTP requests served', ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('lpa_request_seconds', 'End-to-end request latency', ('endpoint',))
+REQUESTS_IN_FLIGHT = Gauge('lpa_requests_in_flight', 'Requests currently being served', ('endpoint',))
+
+# Per-request stage durations for the Server-Timing header; None outside a request
+request_timings = ContextVar('request_timings', default=None)
+
+@contextmanager
+def stage(name):
+    """Time a block of request work into lpa_stage_seconds and the request's Server-Timing"""
+    started = time.perf_counter()
     try:
-        response = requests.get('http://ip-api.com/json/', timeout=5)
-        data = response.json()
-        return {
-            'city': data.get('city', 'Unknown'),
-            'country': data.get('country', 'Unknown'),
-            'lat': data.get('lat', 0),
-            'lon': data.get('lon', 0),
-            'timezone': data.get('timezone', 'UTC'),
-            'isp': data.get('isp', 'Unknown')
-        }
-    except:
-        # Fallback data
-        return {
-            'city': 'San Francisco',
-            'country': 'United States',
-            'lat': 37.7749,
-            'lon': -122.4194,
-            'timezone': 'America/Los_Angeles',
-            'isp': 'Local ISP'
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+def server_timing_header(timings):
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items())
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CACHING - Keep repeat upstream round trips off the request path
+# ══════════════════════════════════════════════════════════════════════════════
+
+WEATHER_CACHE_GRID = float(os.environ.get('WEATHER_CACHE_GRID', 0.1))           # degrees per cell (~11 km)
+WEATHER_CACHE_SIZE = int(os.environ.get('WEATHER_CACHE_SIZE', 4096))            # max cached cells
+WEATHER_UPDATE_MINUTES = int(os.environ.get('WEATHER_UPDATE_MINUTES', 60))      # Open-Meteo refresh cadence
+WEATHER_STALE_SECONDS = int(os.environ.get('WEATHER_STALE_SECONDS', 900))       # serve expired data this long while refreshing
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 4096))          # pre-serialized /api/analyze bodies
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 2048))            # max cached remote city lookups
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 7 * 86400))         # seconds to keep a found city
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 600))         # seconds to remember "not found"
+SHARED_CACHE_FILE = os.environ.get('SHARED_CACHE_FILE', '')                     # SQLite file shared by a host's workers; unset = per-process only
+SHARED_CACHE_SIZE = int(os.environ.get('SHARED_CACHE_SIZE', 50000))            # max shared entries before LRU eviction
+BATCH_MAX_LOCATIONS = int(os.environ.get('BATCH_MAX_LOCATIONS', 500))           # per /api/analyze/batch call
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 100))                 # coordinates per Open-Meteo request
+BATCH_GEOCODE_WORKERS = int(os.environ.get('BATCH_GEOCODE_WORKERS', 4))         # remote city lookups in flight per batch
+BATCH_DEADLINE_SECONDS = float(os.environ.get('BATCH_DEADLINE_SECONDS', 10))    # /api/analyze/batch budget; 0 = none
+
+class SharedCache:
+    """Host-wide cache tier: one SQLite file in WAL mode, shared by every worker process.
+
+    Rows hold JSON values with their expiry; past maxsize the least recently used rows go first.
+    """
+
+    TRIM_EVERY = 256     # writes between eviction passes
+    TOUCH_SECONDS = 60   # refresh a row's LRU position at most this often
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self.writes = 0
+        self.errors = 0
+        self._local = threading.local()     # one connection per thread, reopened after fork
+
+    def _db(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=0.25, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache (ns TEXT, key TEXT, value TEXT, expires REAL, '
+                       'stored REAL, used REAL, PRIMARY KEY (ns, key)) WITHOUT ROWID')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+            self._local.db, self._local.pid = db, os.getpid()
+        return self._local.db
+
+    def _failed(self, e):
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            logger.warning('Shared cache %s unavailable (%d errors): %s', self.path, self.errors, e)
+
+    def get(self, ns, key):
+        """(value, expires_at, stored_at) even if expired, or None"""
+        try:
+            db = self._db()
+            row = db.execute('SELECT value, expires, stored, used FROM cache WHERE ns = ? AND key = ?',
+                             (ns, repr(key))).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[3] > self.TOUCH_SECONDS:
+                db.execute('UPDATE cache SET used = ? WHERE ns = ? AND key = ?', (now, ns, repr(key)))
+            return json.loads(row[0]), row[1], row[2]
+        except (sqlite3.Error, ValueError) as e:
+            self._failed(e)
+            return None
+
+    def set(self, ns, key, value, expires_at, stored_at):
+        try:
+            db = self._db()
+            db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                       (ns, repr(key), json.dumps(value, separators=(',', ':')), expires_at, stored_at, stored_at))
+            self.writes += 1
+            if self.writes % self.TRIM_EVERY == 0:
+                self.trim()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._failed(e)
+
+    def trim(self):
+        """Drop rows past any stale-serving window, then the least recently used beyond maxsize"""
+        db = self._db()
+        db.execute('DELETE FROM cache WHERE expires < ?', (time.time() - WEATHER_STALE_SECONDS,))
+        db.execute('DELETE FROM cache WHERE (ns, key) IN '
+                   '(SELECT ns, key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def clear(self, ns):
+        try:
+            self._db().execute('DELETE FROM cache WHERE ns = ?', (ns,))
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    def stats(self):
+        try:
+            rows = self._db().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        except sqlite3.Error as e:
+            self._failed(e)
+            rows = None
+        return {'path': self.path, 'entries': rows, 'maxsize': self.maxsize, 'errors': self.errors}
+
+class LRUCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters.
+
+    With a SharedCache it is the per-process L1 in front of a host-wide L2: misses fall
+    through to the shared tier, and every set is written to both.
+    """
+
+    def __init__(self, maxsize, shared=None, name=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.name = name                # namespace in the shared tier
+        self.hits = 0
+        self.misses = 0
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self._data = OrderedDict()      # key -> (value, expires_at, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, valid=None):
+        """Return the cached value, or None if missing, expired or rejected by valid(value)"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and valid is not None and not valid(entry[0]):
+                del self._data[key]
+                entry = None
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        if self.shared is None:
+            return None
+
+        entry = self.shared.get(self.name, key)
+        with self._lock:
+            if entry is None or entry[1] <= now or (valid is not None and not valid(entry[0])):
+                self.l2_misses += 1
+                return None
+            self.l2_hits += 1
+            self._store(key, *entry)
+        return entry[0]
+
+    def held(self, key):
+        """True when this process holds an unexpired entry for key - no shared tier, stats or LRU order"""
+        with self._lock:
+            entry = self._data.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def peek(self, key):
+        """Return (value, expires_at, stored_at) even if expired, without touching stats or LRU order"""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(self.name, key)
+        return entry
+
+    def set(self, key, value, expires_at):
+        """Store a value until the given wall-clock time, evicting the LRU entry if full"""
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, value, expires_at, stored_at)
+        if self.shared is not None:
+            self.shared.set(self.name, key, value, expires_at, stored_at)
+
+    def entries(self):
+        """(key, value, expires_at, stored_at) for everything in this process, least recently used first"""
+        with self._lock:
+            return [(key,) + entry for key, entry in self._data.items()]
+
+    def restore(self, entries):
+        """Load entries saved from entries(), as they were - the caller drops expired ones"""
+        with self._lock:
+            for key, value, expires_at, stored_at in entries:
+                self._store(key, value, expires_at, stored_at)
+
+    def _store(self, key, value, expires_at, stored_at):
+        self._data[key] = (value, expires_at, stored_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.l2_hits = self.l2_misses = 0
+        if self.shared is not None:
+            self.shared.clear(self.name)
+
+    def stats(self):
+        """Hits and misses across both tiers, plus a per-tier breakdown when there is a shared tier"""
+        hits = self.hits + self.l2_hits
+        misses = self.l2_misses if self.shared is not None else self.misses
+        stats = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hit_ratio(hits, misses)
         }
+        if self.shared is not None:
+            stats['tiers'] = {
+                'l1': {'hits': self.hits, 'misses': self.misses, 'hit_ratio': hit_ratio(self.hits, self.misses)},
+                'l2': {'hits': self.l2_hits, 'misses': self.l2_misses, 'hit_ratio': hit_ratio(self.l2_hits, self.l2_misses)},
+            }
+        return stats
+
+def hit_ratio(hits, misses):
+    return round(hits / (hits + misses), 3) if hits + misses else 0.0
+
+shared_cache = SharedCache(SHARED_CACHE_FILE, SHARED_CACHE_SIZE) if SHARED_CACHE_FILE else None
+
+weather_cache = LRUCache(WEATHER_CACHE_SIZE, shared_cache, 'weather')
+response_cache = LRUCache(RESPONSE_CACHE_SIZE)   # (cell, timezone, local hour) -> (template, weather it was built from)
+geocode_cache = LRUCache(GEOCODE_CACHE_SIZE, shared_cache, 'geocode')     # normalized name -> Open-Meteo result, or False if none
+
+def weather_cell(lat, lon):
+    """Snap coordinates to the centre of their weather grid cell"""
+    grid = WEATHER_CACHE_GRID
+    return (
+        round((math.floor(lat / grid) + 0.5) * grid, 4),
+        round((math.floor(lon / grid) + 0.5) * grid, 4)
+    )
+
+def weather_bucket(now=None):
+    """Index of the current forecast update period and the time it ends"""
+    period = WEATHER_UPDATE_MINUTES * 60
+    now = time.time() if now is None else now
+    bucket = int(now // period)
+    return bucket, (bucket + 1) * period
+
+# ══════════════════════════════════════════════════════════════════════════════
+# UPSTREAM CLIENT - Pooled keep-alive connections, retries, circuit breaking
+# ══════════════════════════════════════════════════════════════════════════════
+
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 5))          # seconds per attempt
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))            # extra attempts after the first
+UPSTREAM_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', 0.2))        # base delay, doubled per retry
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))       # keep-alive connections per host
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 5))          # consecutive failures to open
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 30))               # seconds open before a trial call
+# Per-quota call limits, "name=N/unit[;N/unit...]" with unit sec|min|hour|day; empty = unlimited.
+# Open-Meteo counts forecast and geocoding calls against the same free-tier quota.
+UPSTREAM_QUOTAS = os.environ.get('UPSTREAM_QUOTAS', 'ip-api=45/min,open-meteo=600/min;5000/hour;10000/day')
+# Nominatim's usage policy allows one request a second per application, whatever UPSTREAM_QUOTAS says.
+# Every worker process has its own buckets, so each gets one call per WEB_CONCURRENCY seconds.
+NOMINATIM_QUOTA = [(1, max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))]
+UPSTREAM_USER_AGENT = os.environ.get('UPSTREAM_USER_AGENT', 'LifePatternAnalyzer/1.0 (+https://github.com/YOUR_USERNAME/life-pattern-analyzer)')
+UPSTREAM_BURST = float(os.environ.get('UPSTREAM_BURST', 0.2))            # share of each quota usable at once
+UPSTREAM_QUEUE_SECONDS = os.environ.get('UPSTREAM_QUEUE_SECONDS', 'interactive=1,batch=5,background=0')
+
+# Who is asking: interactive requests go first, background refreshes only spend spare budget
+PRIORITIES = ('interactive', 'batch', 'background')
+PRIORITY_RESERVE = {'interactive': 0.0, 'batch': 0.25, 'background': 0.5}   # share of each bucket left for higher priorities
+QUEUE_SECONDS = dict({'interactive': 1.0, 'batch': 5.0, 'background': 0.0},
+                     **{name: float(seconds) for name, _, seconds in
+                        (part.partition('=') for part in UPSTREAM_QUEUE_SECONDS.split(',') if part)})
+upstream_priority = ContextVar('upstream_priority', default='interactive')
+
+# One budget for the whole request: every upstream attempt, retry backoff and quota wait fits inside it
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 3))   # /api/analyze budget; 0 = none
+DEADLINE_HEADER = 'X-Request-Timeout'     # clients may ask for a shorter budget, in seconds
+DEADLINE_RESERVE = 0.05                   # kept back for the model and serialization (s)
+MIN_REQUEST_BUDGET = 0.5                  # shortest budget a client may ask for (s)
+request_deadline = ContextVar('request_deadline', default=None)   # time.monotonic() deadline, None = unbounded
+
+DEADLINES = {'analyze': REQUEST_DEADLINE_SECONDS, 'analyze_batch': BATCH_DEADLINE_SECONDS}
+
+def request_budget(requested=None, budget=REQUEST_DEADLINE_SECONDS):
+    """Seconds this request may take: the endpoint's budget, or less if the client asked for less"""
+    try:
+        asked = float(requested)
+    except (TypeError, ValueError):
+        return budget
+    if not (math.isfinite(asked) and asked > 0):
+        return budget
+    asked = max(asked, MIN_REQUEST_BUDGET)
+    return min(budget, asked) if budget else asked
+
+def start_deadline(requested=None, budget=REQUEST_DEADLINE_SECONDS):
+    """Start the current request's clock - returns a reset token"""
+    budget = request_budget(requested, budget)
+    return request_deadline.set(time.monotonic() + budget if budget else None)
+
+def time_left():
+    """Seconds of the request's budget still usable for upstream calls, None if it has no deadline"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - DEADLINE_RESERVE - time.monotonic()
+
+class UpstreamError(Exception):
+    """An upstream call failed after retries, or returned unusable data"""
+
+class CircuitOpenError(UpstreamError):
+    """The upstream's circuit breaker is open - failing fast without a network call"""
+
+class RateLimitedError(UpstreamError):
+    """No quota token could be had before the caller's deadline - no network call was made"""
+
+class DeadlineExceededError(UpstreamError):
+    """The request's budget ran out before another attempt could be made"""
+
+QUOTA_UNITS = {1: 'sec', 60: 'min', 3600: 'hour', 86400: 'day'}
+
+def parse_quotas(spec):
+    """'ip-api=45/min,open-meteo=600/min;10000/day' -> {'ip-api': [(45, 60)], 'open-meteo': [(600, 60), (10000, 86400)]}"""
+    units = {unit: seconds for seconds, unit in QUOTA_UNITS.items()}
+    quotas = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, limits = part.partition('=')
+        quotas[name.strip()] = [(int(count), units[unit.strip()])
+                                for count, _, unit in (limit.partition('/') for limit in limits.split(';'))]
+    return quotas
+
+class TokenBucket:
+    """Continuously refilled bucket, sized so that no window of `seconds` sees more than `limit` calls"""
+
+    def __init__(self, limit, seconds, burst=UPSTREAM_BURST):
+        self.limit = limit
+        self.seconds = seconds
+        self.capacity = max(1.0, limit * burst)
+        self.rate = max(limit - self.capacity, 1) / seconds     # burst + refill over a window = limit
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, needed):
+        """Seconds until the bucket holds `needed` tokens"""
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+class UpstreamGovernor:
+    """Token buckets for one upstream quota, handed out in priority order within each caller's deadline.
+
+    Waiters queue by (priority, arrival); only the head may take a token, and lower priorities
+    must leave PRIORITY_RESERVE of every bucket untouched for the ones above them.
+    """
+
+    def __init__(self, name, limits):
+        self.name = name
+        self.buckets = [TokenBucket(limit, seconds) for limit, seconds in limits]
+        self.granted = dict.fromkeys(PRIORITIES, 0)
+        self.denied = dict.fromkeys(PRIORITIES, 0)
+        self._waiters = []          # heap of (priority rank, arrival, priority)
+        self._arrivals = 0
+        self._cond = threading.Condition()
+
+    def _enqueue(self, priority):
+        with self._cond:
+            self._arrivals += 1
+            entry = (PRIORITIES.index(priority), self._arrivals, priority)
+            heapq.heappush(self._waiters, entry)
+            return entry
+
+    def _poll(self, entry, deadline):
+        """Under the lock: True if a token was taken, False if the deadline can't be met, else seconds to wait"""
+        now = time.monotonic()
+        for bucket in self.buckets:
+            bucket.refill(now)
+        priority = entry[2]
+        if self._waiters[0] is entry:
+            reserve = PRIORITY_RESERVE[priority]
+            wait = max(bucket.wait_for(1 + reserve * bucket.capacity) for bucket in self.buckets)
+            if wait == 0:
+                for bucket in self.buckets:
+                    bucket.tokens -= 1
+                heapq.heappop(self._waiters)
+                self.granted[priority] += 1
+                self._cond.notify_all()
+                return True
+            hopeless = now + wait > deadline    # the tokens won't be there in time - fail now, not later
+        else:
+            wait = deadline - now               # until the waiters ahead move (we are notified) or we give up
+            hopeless = wait <= 0
+        if hopeless:
+            self._leave(entry)
+            self.denied[priority] += 1
+            return False
+        return wait
+
+    def _leave(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def acquire(self, priority, deadline):
+        """Block until a token is granted (True) or it can't be by the monotonic deadline (False)"""
+        entry = self._enqueue(priority)
+        with self._cond:
+            try:
+                while True:
+                    result = self._poll(entry, deadline)
+                    if result is True or result is False:
+                        return result
+                    self._cond.wait(result)
+            finally:
+                self._leave(entry)
+
+    async def acquire_async(self, priority, deadline):
+        """acquire() for the event loop: sleeps instead of blocking on the condition"""
+        entry = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    result = self._poll(entry, deadline)
+                if result is True or result is False:
+                    return result
+                await asyncio.sleep(min(result, 0.05))
+        finally:
+            with self._cond:
+                self._leave(entry)      # e.g. the request was cancelled while queued
+
+    def penalize(self):
+        """The upstream said 429 anyway - spend everything so callers back off"""
+        with self._cond:
+            for bucket in self.buckets:
+                bucket.tokens = min(bucket.tokens, 0.0)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            for bucket in self.buckets:
+                bucket.refill(now)
+            return {
+                'buckets': {f"{bucket.limit}/{QUOTA_UNITS.get(bucket.seconds, f'{bucket.seconds}s')}": {'tokens': round(bucket.tokens, 2),
+                                                                  'capacity': bucket.capacity}
+                            for bucket in self.buckets},
+                'waiting': len(self._waiters),
+                'granted': dict(self.granted),
+                'denied': dict(self.denied),
+            }
+
+GOVERNORS = {name: UpstreamGovernor(name, limits) for name, limits in parse_quotas(UPSTREAM_QUOTAS).items()}
+GOVERNORS['nominatim'] = UpstreamGovernor('nominatim', NOMINATIM_QUOTA)
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after a cool-down"""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """True if a call may proceed; only one trial call is let through while half-open"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """Hand back a half-open trial that never reached the upstream"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+def queue_deadline_for(priority):
+    """How long a caller may wait for a quota token: its priority's limit, within the request's budget"""
+    queue_deadline = time.monotonic() + QUEUE_SECONDS[priority]
+    deadline = request_deadline.get()
+    return queue_deadline if deadline is None else min(queue_deadline, deadline - DEADLINE_RESERVE)
+
+class UpstreamClient:
+    """One upstream host: a pooled keep-alive session, its own circuit breaker and a quota governor"""
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, name, base_url, quota=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.breaker = CircuitBreaker()
+        self.governor = GOVERNORS.get(quota or name)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = UPSTREAM_USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._async_client = None
+        self._async_loop = None
+
+    def observe(self, outcome, started):
+        UPSTREAM_REQUESTS.inc(self.name, outcome)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, self.name)
+
+    def give_up(self, error, attempts, path, params, began):
+        """Count a failed call against the breaker - unless our own deadline or quota cut it short"""
+        if isinstance(error, RateLimitedError):
+            UPSTREAM_REQUESTS.inc(self.name, 'rate_limited')
+        elif isinstance(error, DeadlineExceededError):
+            UPSTREAM_REQUESTS.inc(self.name, 'deadline')
+        if isinstance(error, DeadlineExceededError) or (isinstance(error, RateLimitedError) and attempts == 0):
+            self.breaker.release()
+        else:
+            self.breaker.record_failure()
+        record_exchange(self.name, path, params, began, error=str(error))
+        raise error
+
+    def attempt_timeout(self, timeout):
+        """This attempt's timeout, cut to what is left of the request's budget - None when nothing is left"""
+        left = time_left()
+        if left is None:
+            return timeout
+        return min(timeout, left) if left > 0 else None
+
+    def backoff(self, attempt):
+        """Full jitter: somewhere in [0, base * 2^attempt) - None when the wait would outlast the budget"""
+        delay = random.uniform(0, UPSTREAM_BACKOFF * 2 ** attempt)
+        left = time_left()
+        return None if left is not None and delay >= left else delay
+
+    def attempts(self, path, params, timeout):
+        """The retry policy both transports share, as a generator of I/O steps for get_json to perform.
+
+        Yields ('sleep', seconds), ('acquire', (priority, deadline)) and ('get', timeout); the
+        driver sends back None, the governor's verdict, or the transport's (kind, response-or-error)
+        with kind 'ok', 'timeout', 'error' (retryable) or 'fatal'. Returns the decoded JSON.
+        """
+        if not self.breaker.allow():
+            UPSTREAM_REQUESTS.inc(self.name, 'circuit_open')
+            record_exchange(self.name, path, params, time.perf_counter(), error='circuit open')
+            raise CircuitOpenError(f'{self.name}: circuit open')
+
+        timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+        began = time.perf_counter()
+        priority = upstream_priority.get()
+        queue_deadline = queue_deadline_for(priority)
+        error = None
+        for attempt in range(UPSTREAM_RETRIES + 1):
+            if attempt:
+                delay = self.backoff(attempt)
+                if delay is None:
+                    break
+                yield 'sleep', delay
+            attempt_timeout = self.attempt_timeout(timeout)
+            if attempt_timeout is None:
+                error = DeadlineExceededError(f'{self.name}: request deadline reached')
+                break
+            if self.governor is not None and not (yield 'acquire', (priority, queue_deadline)):
+                error = RateLimitedError(f'{self.name}: over quota')
+                break
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                kind, response = yield 'get', attempt_timeout
+                if kind == 'fatal':
+                    error = UpstreamError(f'{self.name}: {response}')
+                    break
+                if kind == 'timeout' and attempt_timeout < timeout / 2:
+                    # The request's own deadline cut this attempt short - not the upstream's fault
+                    outcome = kind
+                    error = DeadlineExceededError(f'{self.name}: request deadline reached')
+                    break
+                if kind != 'ok':
+                    outcome = kind
+                    error = UpstreamError(f'{self.name}: {response.__class__.__name__}')
+                    continue
+                if response.status_code in self.RETRY_STATUSES:
+                    if response.status_code == 429 and self.governor is not None:
+                        self.governor.penalize()
+                    error = UpstreamError(f'{self.name}: HTTP {response.status_code}')
+                    continue
+                if response.status_code >= 400:
+                    # 4xx - retrying won't help
+                    error = UpstreamError(f'{self.name}: HTTP {response.status_code}')
+                    break
+                data = response.json()
+                outcome = 'success'
+            except ValueError as e:
+                error = UpstreamError(f'{self.name}: unparseable response ({e})')
+                break
+            finally:
+                self.observe(outcome, started)
+            self.breaker.record_success()
+            record_exchange(self.name, path, params, began, data=data)
+            return data
+
+        self.give_up(error, attempt, path, params, began)
+
+    def get_json(self, path, params=None, timeout=None):
+        """GET base_url + path and decode JSON, retrying transient failures with jittered backoff"""
+        url = self.base_url + path
+        steps = self.attempts(path, params, timeout)
+        reply = None
+        try:
+            while True:
+                try:
+                    step, arg = steps.send(reply)
+                except StopIteration as done:
+                    return done.value
+                if step == 'sleep':
+                    reply = time.sleep(arg)
+                elif step == 'acquire':
+                    reply = self.governor.acquire(*arg)
+                else:
+                    reply = self.fetch(url, params, arg)
+        finally:
+            steps.close()       # interrupted mid-attempt (e.g. cancelled) - still count the attempt
+
+    def fetch(self, url, params, timeout):
+        try:
+            return 'ok', self.session.get(url, params=params, timeout=timeout)
+        except requests.Timeout as e:
+            return 'timeout', e
+        except requests.ConnectionError as e:
+            return 'error', e
+        except requests.RequestException as e:
+            return 'fatal', e
+
+    def async_client(self):
+        """The pooled httpx.AsyncClient for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            if self._async_client is not None:
+                self._retire(self._async_client, self._async_loop)
+            self._async_client = httpx.AsyncClient(
+                headers={'User-Agent': UPSTREAM_USER_AGENT},
+                limits=httpx.Limits(max_keepalive_connections=UPSTREAM_POOL_SIZE)
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    @staticmethod
+    def _retire(client, loop):
+        """Close a client left behind by another event loop - on that loop while it still runs"""
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            task = asyncio.ensure_future(_close_quietly(client))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def get_json_async(self, path, params=None, timeout=None):
+        """Non-blocking get_json for the ASGI mode - the same steps, awaited"""
+        url = self.base_url + path
+        steps = self.attempts(path, params, timeout)
+        reply = None
+        try:
+            while True:
+                try:
+                    step, arg = steps.send(reply)
+                except StopIteration as done:
+                    return done.value
+                if step == 'sleep':
+                    reply = await asyncio.sleep(arg)
+                elif step == 'acquire':
+                    reply = await self.governor.acquire_async(*arg)
+                else:
+                    reply = await self.fetch_async(url, params, arg)
+        finally:
+            steps.close()       # interrupted mid-attempt (e.g. cancelled) - still count the attempt
+
+    async def fetch_async(self, url, params, timeout):
+        try:
+            return 'ok', await self.async_client().get(url, params=params, timeout=timeout)
+        except httpx.TimeoutException as e:
+            return 'timeout', e
+        except httpx.TransportError as e:
+            return 'error', e
+        except httpx.HTTPError as e:
+            return 'fatal', e
+
+_background_tasks = set()      # strong references, so pending tasks aren't garbage-collected
+
+async def _close_quietly(client):
+    try:
+        await client.aclose()
+    except Exception as e:      # its connections belonged to a loop that is gone
+        logger.debug('Closing a stale upstream client: %s', e)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution whose result/error all callers share"""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.handoffs = 0
+        self._flights = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """Share one fn(*args) among concurrent callers of key.
+
+        The leader runs the call on its own thread within its own deadline, so a call nobody waits
+        for any more can't outlive it. Followers wait only as long as their budgets allow; if the
+        leader's budget is what ended the call, a follower with time left takes over as leader.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.calls += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                self._run(key, flight, fn, args)
+            elif not flight.done.wait(time_left()):
+                raise DeadlineExceededError('request deadline reached waiting on a shared call')
+            if not leader and self._handed_off(flight.error):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _handed_off(self, error):
+        """True when the shared call died of its leader's deadline and this follower still has time to retry it"""
+        left = time_left()
+        if isinstance(error, DeadlineExceededError) and (left is None or left > 0):
+            self.handoffs += 1
+            return True
+        return False
+
+    def _run(self, key, flight, fn, args):
+        try:
+            flight.result = fn(*args)
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key, fn, *args):
+        """Coroutine flavour of do() for the ASGI mode: concurrent awaits share one task"""
+        while True:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                # The task copies this context, so it runs within the leader's deadline
+                task = self._tasks[key] = asyncio.ensure_future(fn(*args))
+                task.add_done_callback(functools.partial(self._landed, key))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            # Shielded so one cancelled or timed-out waiter doesn't cancel the fetch the others share
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), time_left())
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError('request deadline reached waiting on a shared call')
+            except DeadlineExceededError as e:
+                if leader or not self._handed_off(e):
+                    raise
+
+    def _landed(self, key, task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()        # retrieved, even when every waiter has given up on it
+
+    def stats(self):
+        return {'in_flight': len(self._flights) + len(self._tasks), 'calls': self.calls, 'coalesced': self.coalesced,
+                'handoffs': self.handoffs}
+
+upstream_flights = SingleFlight()
+
+# Base URLs can be pointed elsewhere, e.g. at fake_upstream.py for load tests
+UPSTREAMS = {
+    'ip-api':     UpstreamClient('ip-api', os.environ.get('IP_API_URL', 'http://ip-api.com')),
+    'open-meteo': UpstreamClient('open-meteo', os.environ.get('OPEN_METEO_URL', 'https://api.open-meteo.com')),
+    'geocoding':  UpstreamClient('geocoding', os.environ.get('GEOCODING_URL', 'https://geocoding-api.open-meteo.com'),
+                                 quota='open-meteo'),
+    'nominatim':  UpstreamClient('nominatim', os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')),
+}
+
+def upstream_get(name, path, params=None, timeout=None):
+    """Fetch JSON from a named upstream - raises UpstreamError on failure"""
+    return UPSTREAMS[name].get_json(path, params=params, timeout=timeout)
+
+async def upstream_get_async(name, path, params=None, timeout=None):
+    return await UPSTREAMS[name].get_json_async(path, params=params, timeout=timeout)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# IP GEOLOCATION - the real client address, looked up in a local range database
+# ══════════════════════════════════════════════════════════════════════════════
+
+IP_DB_FILE = os.environ.get('IP_DB_FILE', '')                            # CSV or build_ipdb.py output
+IP_DB_CHECK_SECONDS = float(os.environ.get('IP_DB_CHECK_SECONDS', '60'))  # how often to look for a newer file
+
+# Proxies/load balancers whose X-Forwarded-For entries we believe (comma-separated CIDRs)
+TRUSTED_PROXIES = [ipaddress.ip_network(net.strip(), strict=False)
+                   for net in os.environ.get('TRUSTED_PROXIES', '').split(',') if net.strip()]
+
+def unmapped(addr):
+    """::ffff:a.b.c.d as the IPv4 address it carries, so it hits the same ranges"""
+    return addr.ipv4_mapped if addr.version == 6 and addr.ipv4_mapped else addr
+
+def client_ip(remote_addr, forwarded_for=''):
+    """The caller's address: walk X-Forwarded-For right to left past our own trusted proxies.
+
+    None when the chain breaks (an unparseable hop) or holds only trusted proxies - never a proxy's own address.
+    """
+    chain = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+    for hop in reversed(chain + [remote_addr or '']):
+        try:
+            addr = unmapped(ipaddress.ip_address(hop))
+        except ValueError:
+            return None
+        if not any(addr in net for net in TRUSTED_PROXIES):
+            return addr
+    return None
+
+class _PackedKeys:
+    """Read-only sequence view of fixed-width big-endian keys, so bisect can search IPv6 bytes in place"""
+
+    def __init__(self, buffer, width=16):
+        self.buffer = buffer
+        self.width = width
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, i):
+        return bytes(self.buffer[i * self.width:(i + 1) * self.width])
+
+class _PackedLocations:
+    """Locations of a compiled database, each decoded from its own JSON slice on access"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return tuple(json.loads(bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])))
+
+class IPDatabase:
+    """Sorted, non-overlapping IP ranges searched with bisect: IPv4 as uint32 arrays, IPv6 as 16-byte keys.
+
+    Compiled files (build_ipdb.py) are memory-mapped and decoded lazily, so opening one is O(1), a
+    reload never stalls the serving threads, and forked workers share one copy via the page cache.
+    """
+
+    MAGIC = b'LPAIPDB1'
+    HEADER = struct.Struct('<8sIIII')   # magic, IPv4 ranges, IPv6 ranges, locations, location bytes
+
+    def __init__(self, v4, v6, locations, path=''):
+        self.v4_starts, self.v4_ends, self.v4_locs = v4
+        self.v6_starts, self.v6_ends, self.v6_locs = v6
+        self.locations = locations    # [(city, region, country, lat, lon, timezone)]
+        self.path = path
+
+    def __len__(self):
+        return len(self.v4_locs) + len(self.v6_locs)
+
+    def lookup(self, addr):
+        """Location tuple for an ip_address, or None when no range covers it"""
+        addr = unmapped(addr)
+        if addr.version == 4:
+            key, starts, ends, locs = int(addr), self.v4_starts, self.v4_ends, self.v4_locs
+        else:
+            key, starts, ends, locs = addr.packed, self.v6_starts, self.v6_ends, self.v6_locs
+        i = bisect_right(starts, key) - 1
+        if i < 0 or ends[i] < key:
+            return None
+        return self.locations[locs[i]]
+
+    @classmethod
+    def from_csv(cls, path):
+        """Parse start,end,continent,country,region,city,lat,lon[,timezone] rows (DB-IP "IP to City Lite" layout)"""
+        ranges = {4: [], 6: []}
+        index = {}
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                try:
+                    start, end = ipaddress.ip_address(row[0]), ipaddress.ip_address(row[1])
+                    # No timezone column (DB-IP Lite has none): left empty, estimated at lookup
+                    location = (row[5], row[4], row[3], float(row[6]), float(row[7]),
+                                row[8] if len(row) > 8 else '')
+                except (IndexError, ValueError):
+                    continue    # header, comment or malformed row
+                if start.version != end.version:
+                    continue
+                ranges[start.version].append((start, end, index.setdefault(location, len(index))))
+
+        v4 = sorted(ranges[4])
+        v6 = sorted(ranges[6])
+        return cls(
+            (array('I', [int(s) for s, _, _ in v4]), array('I', [int(e) for _, e, _ in v4]),
+             array('I', [loc for _, _, loc in v4])),
+            (_PackedKeys(b''.join(s.packed for s, _, _ in v6)), _PackedKeys(b''.join(e.packed for _, e, _ in v6)),
+             array('I', [loc for _, _, loc in v6])),
+            list(index), path)
+
+    def save(self, path):
+        """Write the compiled form; written to a temp file and renamed so readers never see half a file"""
+        encoded = [json.dumps(loc, separators=(',', ':'), ensure_ascii=False).encode() for loc in self.locations]
+        offsets = array('I', [0])
+        for chunk in encoded:
+            offsets.append(offsets[-1] + len(chunk))
+        arrays = [array('I', a) for a in (self.v4_starts, self.v4_ends, self.v4_locs, self.v6_locs)] + [offsets]
+        if sys.byteorder != 'little':
+            for a in arrays:
+                a.byteswap()
+        v4_starts, v4_ends, v4_locs, v6_locs, offsets = arrays
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(v4_locs), len(v6_locs), len(encoded), sum(map(len, encoded))))
+            for chunk in (v4_starts, v4_ends, v4_locs, bytes(self.v6_starts.buffer), bytes(self.v6_ends.buffer),
+                          v6_locs, offsets):
+                f.write(chunk if isinstance(chunk, bytes) else chunk.tobytes())
+            f.writelines(encoded)
+        os.replace(tmp, path)
+
+    @classmethod
+    def open_compiled(cls, path):
+        """Memory-map a compiled file - nothing is copied into the process up front"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        magic, n4, n6, nloc, loc_bytes = cls.HEADER.unpack_from(view)
+        if magic != cls.MAGIC:
+            raise ValueError(f'{path}: not a compiled IP database')
+        if len(view) != cls.HEADER.size + 12 * n4 + 36 * n6 + 4 * (nloc + 1) + loc_bytes:
+            raise ValueError(f'{path}: truncated IP database')
+
+        offset = cls.HEADER.size
+        def take(size):
+            nonlocal offset
+            chunk = view[offset:offset + size]
+            offset += size
+            return chunk
+
+        def uint32s(n):
+            chunk = take(4 * n)
+            if sys.byteorder == 'little':
+                return chunk.cast('I')
+            values = array('I', bytes(chunk))
+            values.byteswap()
+            return values
+
+        v4 = (uint32s(n4), uint32s(n4), uint32s(n4))
+        v6 = (_PackedKeys(take(16 * n6)), _PackedKeys(take(16 * n6)), uint32s(n6))
+        locations = _PackedLocations(uint32s(nloc + 1), take(loc_bytes))
+        return cls(v4, v6, locations, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            compiled = f.read(len(cls.MAGIC)) == cls.MAGIC
+        return cls.open_compiled(path) if compiled else cls.from_csv(path)
+
+class LocalIPDatabase:
+    """The loaded IPDatabase, swapped atomically when the file changes - lookups never wait for a reload"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.mtime = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.hits = 0
+        self.misses = 0
+        self._checked = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+        if path:
+            self.reload()
+
+    def lookup(self, addr):
+        """Location dict for a client address, or None (no database, or no range covers it)"""
+        self.maybe_reload()
+        db = self.db
+        if db is None:
+            return None
+        found = db.lookup(addr)
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        city, region, country, lat, lon, timezone = found
+        return {'city': city or 'Unknown', 'region': region, 'country': country,
+                'lat': lat, 'lon': lon, 'timezone': timezone or estimated_timezone(lat, lon),
+                'isp': 'IP database'}
+
+    def reload(self):
+        """Load the file into a new IPDatabase, then swap it in; the old one serves until then"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            started = time.perf_counter()
+            db = IPDatabase.load(self.path)
+        except (OSError, ValueError) as e:
+            logger.error('IP database %s not loaded: %s', self.path, e)
+            return False
+        self.db, self.mtime, self.loaded_at = db, mtime, time.time()
+        self.reloads += 1
+        logger.info('IP database %s loaded: %d ranges in %.0f ms',
+                    self.path, len(db), (time.perf_counter() - started) * 1000)
+        return True
+
+    def maybe_reload(self):
+        """At most every IP_DB_CHECK_SECONDS, stat the file and reload it on a thread if it changed"""
+        now = time.monotonic()
+        if not self.path or now - self._checked < IP_DB_CHECK_SECONDS:
+            return
+        self._checked = now
+        try:
+            changed = os.stat(self.path).st_mtime != self.mtime
+        except OSError:
+            return
+        with self._lock:
+            if not changed or self._reloading:
+                return
+            self._reloading = True
+
+        def run():
+            try:
+                self.reload()
+            finally:
+                self._reloading = False
+        threading.Thread(target=run, name='ipdb-reload', daemon=True).start()
+
+    def stats(self):
+        db = self.db
+        return {'file': self.path, 'loaded': db is not None,
+                'ranges': len(db) if db is not None else 0,
+                'locations': len(db.locations) if db is not None else 0,
+                'loaded_at': self.loaded_at, 'reloads': self.reloads,
+                'hits': self.hits, 'misses': self.misses}
+
+ip_database = LocalIPDatabase(IP_DB_FILE)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# GAZETTEER - bundled city list: prefix-trie autocomplete and local geocoding
+# ══════════════════════════════════════════════════════════════════════════════
+
+GAZETTEER_FILE = os.environ.get('GAZETTEER_FILE') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.tsv')
+AUTOCOMPLETE_LIMIT = 10   # suggestions kept per trie node (and the most /api/cities returns)
+
+# Letters NFKD doesn't split into base + accent
+_LETTER_FOLDS = str.maketrans({'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'æ': 'ae', 'œ': 'oe', 'ı': 'i',
+                               "'": None, '’': None})
+
+def normalize_name(text):
+    """Case-, accent- and punctuation-blind search key: "São Paulo" -> "sao paulo" """
+    text = unicodedata.normalize('NFKD', text.casefold().translate(_LETTER_FOLDS))
+    return ' '.join(re.sub(r'\W+', ' ', ''.join(c for c in text if not unicodedata.combining(c))).split())
+
+class _TrieNode:
+    __slots__ = ('children', 'ids', 'top')
+
+    def __init__(self):
+        self.children = {}   # first character -> (edge label, child node)
+        self.ids = ()        # cities whose key ends exactly here
+        self.top = ()        # the AUTOCOMPLETE_LIMIT most populous cities below here
+
+class Gazetteer:
+    """Cities indexed by normalized name in a path-compressed prefix trie.
+
+    Every node stores its top suggestions, so completing a prefix is one walk down the trie; typos
+    fall back to a bounded edit-distance walk over the same trie.
+    """
+
+    def __init__(self, cities):
+        self.cities = cities   # Open-Meteo geocoding result shape: name, admin1, country, latitude, ...
+        plain = {}
+        for i, city in enumerate(cities):
+            for key in city.pop('keys'):
+                node = plain
+                for ch in key:
+                    node = node.setdefault(ch, {})
+                node.setdefault('', []).append(i)
+        self.root = self._compress(plain)
+
+    def _rank(self, ids):
+        ids = dict.fromkeys(ids)    # a city indexed under two keys appears once
+        return tuple(heapq.nlargest(AUTOCOMPLETE_LIMIT, ids, key=lambda i: self.cities[i]['population']))
+
+    def _compress(self, plain):
+        node = _TrieNode()
+        node.ids = self._rank(plain.get('', ()))
+        candidates = list(node.ids)
+        for ch, child in plain.items():
+            if not ch:
+                continue
+            label = ch
+            while len(child) == 1 and '' not in child:   # fold single-child chains into one edge
+                (nxt, child), = child.items()
+                label += nxt
+            compressed = self._compress(child)
+            node.children[ch] = (label, compressed)
+            candidates.extend(compressed.top)
+        node.top = self._rank(candidates)
+        return node
+
+    def _find(self, key):
+        """(node, exact) for the node at or just below `key`; exact=False when key ends mid-edge"""
+        node, rest = self.root, key
+        while rest:
+            edge = node.children.get(rest[0])
+            if edge is None:
+                return None, False
+            label, child = edge
+            if rest.startswith(label):
+                node, rest = child, rest[len(label):]
+            elif label.startswith(rest):
+                return child, False
+            else:
+                return None, False
+        return node, True
+
+    def suggest(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """(cities, fuzzy) completing `query` - most populous first, typo-tolerant if nothing matches"""
+        key = normalize_name(query)
+        if not key:
+            return [], False
+        node, _ = self._find(key)
+        if node is not None and node.top:
+            return [self.cities[i] for i in node.top[:limit]], False
+        matches = self._fuzzy(key, 1 if len(key) <= 4 else 2) if len(key) >= 3 else {}
+        ranked = sorted(matches, key=lambda i: (matches[i], -self.cities[i]['population']))
+        return [self.cities[i] for i in ranked[:limit]], True
+
+    def _fuzzy(self, key, max_edits):
+        """{city id: edits} for cities with a name prefix within max_edits of key (Levenshtein rows down the trie)"""
+        found = {}
+
+        def note(ids, edits):
+            for i in ids:
+                if edits < found.get(i, max_edits + 1):
+                    found[i] = edits
+
+        def walk(edges, row):
+            for label, child in edges:
+                current = row
+                for ch in label:
+                    nxt = [current[0] + 1]
+                    for j, qc in enumerate(key, 1):
+                        nxt.append(min(nxt[j - 1] + 1, current[j] + 1, current[j - 1] + (qc != ch)))
+                    current = nxt
+                    if min(current) > max_edits:
+                        break
+                    if current[-1] <= max_edits:
+                        note(child.top, current[-1])
+                else:
+                    walk(child.children.values(), current)
+
+        # Typos rarely hit the first letter; anchoring on it keeps the walk inside one subtree
+        first = self.root.children.get(key[0])
+        if first is not None:
+            walk([first], list(range(len(key) + 1)))
+        return found
+
+    def resolve(self, text):
+        """Most populous exact name match for "City" or "City, Region, Country" - None when not bundled"""
+        name, *qualifiers = [part for part in (normalize_name(p) for p in text.split(',')) if part] or ['']
+        node, exact = self._find(name)
+        if node is None or not exact:
+            return None
+        for i in node.ids:
+            city = self.cities[i]
+            places = (normalize_name(city['admin1']), normalize_name(city['country']))
+            if all(any(place.startswith(q) for place in places) for q in qualifiers):
+                return city
+        return None
+
+    @classmethod
+    def load(cls, path):
+        """Bundled TSV (name, region, country, lat, lon, population, timezone) or a GeoNames cities*.txt dump"""
+        cities = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                row = line.rstrip('\n').split('\t')
+                if len(row) >= 18:    # GeoNames: name, asciiname ... country code, admin1 code ... timezone
+                    name, region, country, lat, lon, population, tz = (
+                        row[1], row[10], row[8], row[4], row[5], row[14], row[17])
+                    keys = {normalize_name(row[1]), normalize_name(row[2])}
+                else:
+                    name, region, country, lat, lon, population, tz = row[:7]
+                    keys = {normalize_name(name)}
+                cities.append({'name': name, 'admin1': region, 'country': country,
+                               'latitude': float(lat), 'longitude': float(lon),
+                               'population': int(population or 0), 'timezone': tz or 'UTC',
+                               'keys': keys - {''}})
+        return cls(cities)
+
+def load_gazetteer(path):
+    try:
+        return Gazetteer.load(path)
+    except (OSError, ValueError, IndexError) as e:
+        logger.error('Gazetteer %s not loaded, city lookups go to the remote geocoder: %s', path, e)
+        return Gazetteer([])
+
+gazetteer = load_gazetteer(GAZETTEER_FILE)
+
+REVERSE_GEOCODE_RADIUS_KM = float(os.environ.get('REVERSE_GEOCODE_RADIUS_KM', '15'))   # farther = ask Nominatim for a name
+ZONE_RADIUS_KM = float(os.environ.get('ZONE_RADIUS_KM', '75'))                        # farther = zone from solar time
+EARTH_RADIUS_KM = 6371.0
+
+class PlaceIndex:
+    """Static KD-tree over places as unit vectors, so nearest-place search needs no longitude wrap-around"""
+
+    def __init__(self, places):
+        self.places = places
+        self.root = self._build([(self._xyz(p['latitude'], p['longitude']), i) for i, p in enumerate(places)], 0)
+
+    @staticmethod
+    def _xyz(lat, lon):
+        lat, lon = math.radians(lat), math.radians(lon)
+        return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        mid = len(points) // 2
+        xyz, i = points[mid]
+        return (xyz, i, axis, self._build(points[:mid], depth + 1), self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lon):
+        """(place, great-circle km) closest to (lat, lon), or None when there are no places"""
+        target = self._xyz(lat, lon)
+        best = [None, float('inf')]   # place index, squared chord length
+
+        def search(node):
+            if node is None:
+                return
+            xyz, i, axis, left, right = node
+            d = (xyz[0] - target[0]) ** 2 + (xyz[1] - target[1]) ** 2 + (xyz[2] - target[2]) ** 2
+            if d < best[1]:
+                best[0], best[1] = i, d
+            diff = target[axis] - xyz[axis]
+            search(left if diff < 0 else right)
+            if diff * diff < best[1]:     # the splitting plane is closer than the best so far
+                search(right if diff < 0 else left)
+
+        search(self.root)
+        if best[0] is None:
+            return None
+        return self.places[best[0]], 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(best[1]) / 2))
+
+place_index = PlaceIndex(gazetteer.cities)
+
+def reverse_geocode(lat, lon):
+    """The nearest bundled place: its names within REVERSE_GEOCODE_RADIUS_KM, its IANA timezone within ZONE_RADIUS_KM.
+
+    None when nothing is within ZONE_RADIUS_KM; city None when the place is too far off to name the point.
+    """
+    found = place_index.nearest(lat, lon)
+    if found is None or found[1] > ZONE_RADIUS_KM:
+        return None
+    place, km = found
+    near = km <= REVERSE_GEOCODE_RADIUS_KM
+    return {'city': place['name'] if near else None,
+            'region': place['admin1'] if near else '',
+            'country': place['country'] if near else '',
+            'timezone': place['timezone'],
+            'distance_km': round(km, 1)}
+
+def nominatim_params(lat, lon):
+    return {'lat': lat, 'lon': lon, 'format': 'json', 'zoom': 10, 'addressdetails': 1, 'accept-language': 'en'}
+
+def place_key(lat, lon):
+    """Cache key for names around a coordinate - ~1 km cells; '@' never starts a normalized city name"""
+    return f'@{lat:.2f},{lon:.2f}'
+
+def remember_place(key, data):
+    """Cache Nominatim's answer like a city lookup and return {city, region, country}, or None"""
+    try:
+        address = data.get('address') or {}
+    except AttributeError:
+        address = {}
+    city = (address.get('suburb') or address.get('village') or address.get('town') or address.get('city')
+            or address.get('municipality') or address.get('county'))
+    place = {'city': city, 'region': address.get('state') or address.get('region') or '',
+             'country': address.get('country', '')} if city else None
+    geocode_cache.set(key, place or False, time.time() + (GEOCODE_CACHE_TTL if place else GEOCODE_NEGATIVE_TTL))
+    return place
+
+def remote_place(lat, lon):
+    """Nominatim's names for a coordinate no bundled place is near - None when it has none or is unavailable"""
+    key = place_key(lat, lon)
+    found, place = cached_geocode(key)
+    if found:
+        return place
+    GEOCODES.inc('remote')
+    try:
+        data = upstream_flights.do(('nominatim', key), upstream_get, 'nominatim', '/reverse', nominatim_params(lat, lon))
+    except UpstreamError as e:
+        logger.warning('Reverse geocoding unavailable: %s', e)
+        return None
+    return remember_place(key, data)
+
+def estimated_timezone(lat, lon):
+    """Best zone when nobody told us one: a bundled place's within ZONE_RADIUS_KM, else solar time"""
+    place = reverse_geocode(lat, lon)
+    return place['timezone'] if place is not None else solar_timezone(lon)
+
+def solar_timezone(lon):
+    hours = round(max(-180.0, min(180.0, lon)) / 15)
+    return f'Etc/GMT{-hours:+d}' if hours else 'UTC'     # POSIX sign: Etc/GMT+7 is UTC-7
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LOCAL TIME - time-of-day modelling runs on the location's wall clock, not ours
+# ══════════════════════════════════════════════════════════════════════════════
+
+ZONE_TABLE_DAYS = int(os.environ.get('ZONE_TABLE_DAYS', 400))   # offset table horizon per zone
+
+def load_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return None
+
+def known_zone(name):
+    return isinstance(name, str) and (name in ZONES or load_zone(name) is not None)
+
+# Every bundled place's zone is loaded once at startup; other valid names are added on first use
+ZONES = {}
+for _name in sorted({city['timezone'] for city in gazetteer.cities} | {'UTC'}):
+    _zone = load_zone(_name)
+    if _zone is not None:
+        ZONES[_name] = _zone
+
+class ZoneOffsets:
+    """A zone's UTC offsets over the next ZONE_TABLE_DAYS: one entry per DST/offset transition.
+
+    Built by sampling the offset once a day and bisecting each change down to the second,
+    so converting a timestamp afterwards is a range check and a bisect over a few entries.
+    """
+
+    def __init__(self, zone, now):
+        self.zone = zone
+        self.start = int(now) - int(now) % 86400
+        self.end = self.start + ZONE_TABLE_DAYS * 86400
+        self.starts = [self.start]                  # UTC second each offset takes effect
+        self.offsets = [self._offset(self.start)]   # seconds east of UTC from then on
+        for day in range(1, ZONE_TABLE_DAYS + 1):
+            hi = self.start + day * 86400
+            offset = self._offset(hi)
+            if offset == self.offsets[-1]:
+                continue
+            lo = hi - 86400                         # the change happened in (lo, hi]
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if self._offset(mid) == offset:
+                    hi = mid
+                else:
+                    lo = mid
+            self.starts.append(hi)
+            self.offsets.append(offset)
+
+    def _offset(self, ts):
+        return int(datetime.fromtimestamp(ts, self.zone).utcoffset().total_seconds())
+
+    def offset(self, ts):
+        """Seconds east of UTC at ts, or None once ts is outside the table"""
+        if not self.start <= ts < self.end:
+            return None
+        return self.offsets[bisect_right(self.starts, ts) - 1]
+
+_zone_offsets = {}
+
+def utc_offset(tz_name, ts):
+    """Seconds east of UTC for an IANA zone at a Unix time; 0 for unknown zones"""
+    table = _zone_offsets.get(tz_name)
+    offset = table.offset(ts) if table is not None else None
+    if offset is not None:
+        return offset
+    zone = ZONES.get(tz_name)
+    if zone is None:
+        zone = load_zone(tz_name) if tz_name else None
+        if zone is None:
+            return 0        # don't remember bad names - clients can send anything
+        ZONES[tz_name] = zone
+    table = _zone_offsets[tz_name] = ZoneOffsets(zone, ts)
+    return table.offset(ts)
+
+def local_time(tz_name, ts=None):
+    """Naive wall-clock time in the zone right now (or at ts)"""
+    ts = datetime.now(timezone.utc).timestamp() if ts is None else ts
+    return datetime.fromtimestamp(ts + utc_offset(tz_name, ts), timezone.utc).replace(tzinfo=None)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REAL DATA SOURCES - All working without API keys!
+# ══════════════════════════════════════════════════════════════════════════════
+
+FALLBACK_LOCATION = {
+    'city': 'San Francisco',
+    'country': 'United States',
+    'lat': 37.7749,
+    'lon': -122.4194,
+    'timezone': 'America/Los_Angeles',
+    'isp': 'Local ISP',
+    'degraded': True
+}
+
+FALLBACK_WEATHER = {
+    'temperature': 22,
+    'humidity': 65,
+    'wind_speed': 10,
+    'pressure': 1013,
+    'condition': 'Clear sky',
+    'degraded': True
+}
+
+# What we actually read from Open-Meteo. The model, insights and UI cards only use
+# current conditions; the hourly series is fetched solely for callers that opt in
+# with "include": ["hourly"], and only for the 24h the timeline covers.
+WEATHER_DATA_NEEDS = {
+    'current': 'temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m,pressure_msl',
+    'hourly': 'temperature_2m,relative_humidity_2m,weather_code',
+    'forecast_hours': 24,
+}
+
+# Weather code to description mapping
+WEATHER_CODES = {
+    0: 'Clear sky', 1: 'Mainly clear', 2: 'Partly cloudy', 3: 'Overcast',
+    45: 'Foggy', 48: 'Foggy', 51: 'Light drizzle', 53: 'Moderate drizzle',
+    61: 'Light rain', 63: 'Moderate rain', 65: 'Heavy rain',
+    71: 'Light snow', 73: 'Moderate snow', 75: 'Heavy snow',
+    95: 'Thunderstorm'
+}
+
+def get_ip_location(ip=None):
+    """Get user's location from IP: the local database first, then ip-api - No API key needed!"""
+    location = local_ip_location(ip)
+    if location is not None:
+        return location
+    path = ip_api_path(ip)
+    try:
+        return parse_ip_location(upstream_flights.do(('ip-api', path), upstream_get, 'ip-api', path))
+    except (UpstreamError, AttributeError) as e:
+        return ip_location_fallback(e)
+
+def local_ip_location(ip):
+    """The range database's answer for a public address, None when ip-api must be asked"""
+    return ip_database.lookup(ip) if ip is not None and ip.is_global else None
+
+def ip_location_fallback(error):
+    logger.warning('IP location unavailable, using fallback: %s', error)
+    FALLBACKS.inc('location')
+    return dict(FALLBACK_LOCATION)
+
+def ip_api_path(ip):
+    """ip-api locates the address we pass; private addresses (local dev) fall back to our own"""
+    return f'/json/{ip}' if ip is not None and ip.is_global else '/json/'
+
+def parse_ip_location(data):
+    return {
+        'city': data.get('city', 'Unknown'),
+        'country': data.get('country', 'Unknown'),
+        'lat': data.get('lat', 0),
+        'lon': data.get('lon', 0),
+        'timezone': data.get('timezone', 'UTC'),
+        'isp': data.get('isp', 'Unknown')
+    }
 
 def get_weather(lat, lon):
-    """Get weather data from Open-Meteo (free, no API key!)"""
+    """Get weather for the grid cell containing (lat, lon), cached per forecast period"""
+    cell = weather_cell(lat, lon)
+    bucket = weather_bucket()[0]
+
+    weather = cached_weather(cell, bucket)
+    if weather is not None:
+        return weather
+
+    try:
+        return dict(fill_weather(cell, bucket))
+    except UpstreamError as e:
+        return weather_fallback(cell, bucket, e)
+
+def weather_fallback(cell, bucket, error):
+    """The cell's last known conditions however old, else the modelled defaults - flagged degraded either way"""
+    logger.warning('Weather unavailable, using fallback: %s', error)
+    FALLBACKS.inc('weather')
+    last = weather_cache.peek((cell, bucket - 1))
+    if last is None:
+        return dict(FALLBACK_WEATHER)
+    return dict(last[0], stale=True, degraded=True, age=int(time.time() - last[2]))
+
+def cached_weather(cell, bucket):
+    """Fresh cached weather, or last period's entry flagged stale - None on a real miss"""
+    if upstream_priority.get() == 'interactive':
+        weather_refresher.touch(cell)    # only single-location requests make a cell hot, not one-off batch lookups
+    cached = weather_cache.get((cell, bucket))
+    if cached is not None:
+        return dict(cached)
+
+    # Last period's entry is still close enough: serve it now, refresh in the background -
+    # unless no refresh can be queued, in which case the caller fetches inline
+    stale = weather_cache.peek((cell, bucket - 1))
+    if (stale is not None and time.time() - stale[1] <= WEATHER_STALE_SECONDS
+            and weather_refresher.schedule(cell, bucket)):
+        weather = dict(stale[0])
+        weather['stale'] = True
+        weather['age'] = int(time.time() - stale[2])
+        return weather
+    return None
+
+def fill_weather(cell, bucket):
+    """Fetch and cache one cell for one forecast period, coalescing concurrent fills"""
+    key = (cell, bucket)
+    period = WEATHER_UPDATE_MINUTES * 60
+
+    def fill():
+        # Re-check under the flight: a previous leader may have just stored this key
+        weather = unexpired_weather(key)
+        if weather is None:
+            weather = fetch_weather(*cell)
+            weather_cache.set(key, weather, (bucket + 1) * period)
+        return weather
+
+    return upstream_flights.do(('weather',) + key, fill)
+
+def unexpired_weather(key):
+    entry = weather_cache.peek(key)
+    return entry[0] if entry is not None and entry[1] > time.time() else None
+
+def forecast_params(lat, lon, hourly=False):
+    """Open-Meteo query limited to WEATHER_DATA_NEEDS - current conditions, or the hourly series"""
+    params = {'latitude': lat, 'longitude': lon, 'timezone': 'auto'}
+    if hourly:
+        params['hourly'] = WEATHER_DATA_NEEDS['hourly']
+        params['forecast_hours'] = WEATHER_DATA_NEEDS['forecast_hours']
+    else:
+        params['current'] = WEATHER_DATA_NEEDS['current']
+    return params
+
+def fetch_weather(lat, lon):
+    """Get weather data from Open-Meteo (free, no API key!) - raises UpstreamError"""
+    return parse_forecast(upstream_get('open-meteo', '/v1/forecast', params=forecast_params(lat, lon)))
+
+def parse_forecast(data):
     try:
-        url = f'https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m,pressure_msl&hourly=temperature_2m,relative_humidity_2m,weather_code&timezone=auto'
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
         current = data.get('current', {})
-        
-        # Weather code to description mapping
-        weather_codes = {
-            0: 'Clear sky', 1: 'Mainly clear', 2: 'Partly cloudy', 3: 'Overcast',
-            45: 'Foggy', 48: 'Foggy', 51: 'Light drizzle', 53: 'Moderate drizzle',
-            61: 'Light rain', 63: 'Moderate rain', 65: 'Heavy rain',
-            71: 'Light snow', 73: 'Moderate snow', 75: 'Heavy snow',
-            95: 'Thunderstorm'
-        }
-        
         code = current.get('weather_code', 0)
-        
         return {
             'temperature': round(current.get('temperature_2m', 20), 1),
             'humidity': current.get('relative_humidity_2m', 50),
             'wind_speed': round(current.get('wind_speed_10m', 10), 1),
             'pressure': current.get('pressure_msl', 1013),
-            'condition': weather_codes.get(code, 'Clear'),
-            'hourly': data.get('hourly', {})
-        }
-    except:
-        return {
-            'temperature': 22,
-            'humidity': 65,
-            'wind_speed': 10,
-            'pressure': 1013,
-            'condition': 'Clear sky',
-            'hourly': {}
+            'condition': WEATHER_CODES.get(code, 'Clear')
         }
+    except (AttributeError, TypeError) as e:
+        raise UpstreamError(f'open-meteo: malformed forecast ({e})')
+
+def get_hourly_forecast(lat, lon):
+    """Opt-in hourly series for the cell's next 24h, cached alongside current conditions"""
+    cell = weather_cell(lat, lon)
+    bucket, expires_at = weather_bucket()
+    key = (cell, bucket, 'hourly')
+
+    def fill():
+        hourly = weather_cache.get(key)
+        if hourly is None:
+            data = upstream_get('open-meteo', '/v1/forecast', params=forecast_params(*cell, hourly=True))
+            hourly = data.get('hourly') or {}
+            weather_cache.set(key, hourly, expires_at)
+        return hourly
 
-def get_moon_phase():
-    """Calculate current moon phase and influence"""
+    try:
+        return upstream_flights.do(('weather',) + key, fill)
+    except (UpstreamError, AttributeError) as e:
+        logger.warning('Hourly forecast unavailable: %s', e)
+        FALLBACKS.inc('hourly')
+        return {}
+
+def wants_hourly(body):
+    include = body.get('include') or []
+    return 'hourly' in (include.split(',') if isinstance(include, str) else include)
+
+def fetch_weather_bulk(cells):
+    """One multi-coordinate Open-Meteo request - parsed forecasts in the same order as cells"""
+    data = upstream_get('open-meteo', '/v1/forecast', params=forecast_params(
+        ','.join(str(lat) for lat, _ in cells),
+        ','.join(str(lon) for _, lon in cells)
+    ))
+    # A single coordinate comes back as an object, several as a list
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or len(data) != len(cells):
+        raise UpstreamError('open-meteo: bulk forecast does not match the requested coordinates')
+    return [parse_forecast(d) for d in data]
+
+def get_weather_many(coords):
+    """Weather for many coordinates keyed by grid cell: cache first, then chunked bulk requests"""
+    bucket, expires_at = weather_bucket()
+    found, missing = {}, []
+    for cell in dict.fromkeys(weather_cell(lat, lon) for lat, lon in coords):
+        weather = cached_weather(cell, bucket)
+        if weather is None:
+            missing.append(cell)
+        else:
+            found[cell] = weather
+
+    for i in range(0, len(missing), BATCH_CHUNK_SIZE):
+        chunk = missing[i:i + BATCH_CHUNK_SIZE]
+        try:
+            for cell, weather in zip(chunk, fetch_weather_bulk(chunk)):
+                weather_cache.set((cell, bucket), weather, expires_at)
+                found[cell] = dict(weather)
+        except UpstreamError as e:
+            logger.warning('Bulk weather for %d cells unavailable, using fallback: %s', len(chunk), e)
+            FALLBACKS.inc('weather', amount=len(chunk))
+            for cell in chunk:
+                found[cell] = dict(FALLBACK_WEATHER)
+    return found
+
+def geocoding_params(name):
+    return {'name': name, 'count': 1, 'language': 'en', 'format': 'json'}
+
+def geocoding_query(name):
+    """Whitespace-collapsed remote query and the cache key every equivalent spelling shares"""
+    query = ' '.join(name.split())
+    return query, normalize_name(query)
+
+def cached_geocode(key):
+    """(True, result-or-None) for a remembered remote lookup, (False, None) if it must be fetched"""
+    cached = geocode_cache.get(key)
+    if cached is None:
+        return False, None
+    GEOCODES.inc('cache' if cached else 'negative_cache')
+    return True, cached or None
+
+def remember_geocode(key, data):
+    """Cache a remote answer - found cities for long, misses only briefly - and return its first match"""
+    result = first_geocoding_result(data)
+    ttl = GEOCODE_CACHE_TTL if result else GEOCODE_NEGATIVE_TTL
+    geocode_cache.set(key, result or False, time.time() + ttl)
+    return result
+
+def known_geocode(name):
+    """(True, result-or-None) when the gazetteer or the cache answers for name, (False, None) if it must be fetched"""
+    local = gazetteer.resolve(name)
+    if local is not None:
+        GEOCODES.inc('local')
+        return True, local
+    found, result = cached_geocode(geocoding_query(name)[1])
+    if not found:
+        GEOCODES.inc('remote')
+    return found, result
+
+def geocode_city(name):
+    """Look up a city in the bundled gazetteer, else with Open-Meteo geocoding - first match, or None if not found"""
+    found, result = known_geocode(name)
+    if found:
+        return result
+    query, key = geocoding_query(name)
+    data = upstream_flights.do(('geocoding', key), upstream_get, 'geocoding', '/v1/search', geocoding_params(query))
+    return remember_geocode(key, data)
+
+def first_geocoding_result(data):
+    results = data.get('results') or []
+    return results[0] if results else None
+
+MOON_PHASE_NAMES = [
+    'New Moon', 'Waxing Crescent', 'First Quarter', 'Waxing Gibbous',
+    'Full Moon', 'Waning Gibbous', 'Last Quarter', 'Waning Crescent'
+]
+
+MOON_EMOJIS = ['🌑', '🌒', '🌓', '🌔', '🌕', '🌖', '🌗', '🌘']
+
+# Moon influence on energy (based on traditional wisdom)
+MOON_INFLUENCE = {
+    0: {'focus': 90, 'creativity': 95, 'social': 50},  # New Moon
+    1: {'focus': 85, 'creativity': 90, 'social': 60},  # Waxing Crescent
+    2: {'focus': 75, 'creativity': 80, 'social': 70},  # First Quarter
+    3: {'focus': 70, 'creativity': 75, 'social': 80},  # Waxing Gibbous
+    4: {'focus': 60, 'creativity': 70, 'social': 95},  # Full Moon
+    5: {'focus': 70, 'creativity': 75, 'social': 85},  # Waning Gibbous
+    6: {'focus': 80, 'creativity': 80, 'social': 70},  # Last Quarter
+    7: {'focus': 85, 'creativity': 85, 'social': 60},  # Waning Crescent
+}
+
+def get_moon_phase(now=None):
+    """Calculate the moon phase and influence for a local date (default: today here)"""
     # Moon cycle is approximately 29.53 days
     known_new_moon = datetime(2000, 1, 6, 18, 14)
     moon_cycle = 29.53
     
-    now = datetime.now()
+    now = datetime.now() if now is None else now
     days_since = (now - known_new_moon).days
     current_phase = (days_since % moon_cycle) / moon_cycle
     
-    phase_names = [
-        'New Moon', 'Waxing Crescent', 'First Quarter', 'Waxing Gibbous',
-        'Full Moon', 'Waning Gibbous', 'Last Quarter', 'Waning Crescent'
-    ]
-    
     phase_index = int(current_phase * 8) % 8
     illumination = abs(math.cos((current_phase - 0.5) * 2 * math.pi)) * 100
     
-    # Moon influence on energy (based on traditional wisdom)
-    energy_influence = {
-        0: {'focus': 90, 'creativity': 95, 'social': 50},  # New Moon
-        1: {'focus': 85, 'creativity': 90, 'social': 60},  # Waxing Crescent
-        2: {'focus': 75, 'creativity': 80, 'social': 70},  # First Quarter
-        3: {'focus': 70, 'creativity': 75, 'social': 80},  # Waxing Gibbous
-        4: {'focus': 60, 'creativity': 70, 'social': 95},  # Full Moon
-        5: {'focus': 70, 'creativity': 75, 'social': 85},  # Waning Gibbous
-        6: {'focus': 80, 'creativity': 80, 'social': 70},  # Last Quarter
-        7: {'focus': 85, 'creativity': 85, 'social': 60},  # Waning Crescent
-    }
-    
     return {
-        'phase': phase_names[phase_index],
+        'phase': MOON_PHASE_NAMES[phase_index],
         'illumination': round(illumination, 1),
-        'influence': energy_influence[phase_index],
-        'emoji': ['🌑', '🌒', '🌓', '🌔', '🌕', '🌖', '🌗', '🌘'][phase_index]
+        'influence': dict(MOON_INFLUENCE[phase_index]),
+        'emoji': MOON_EMOJIS[phase_index]
     }
 
-def calculate_circadian_rhythm():
-    """Calculate optimal times based on circadian science"""
-    now = datetime.now()
+def calculate_circadian_rhythm(now=None):
+    """Calculate optimal times based on circadian science, for a local time (default: now here)"""
+    now = datetime.now() if now is None else now
     hour = now.hour
     
     # Based on circadian rhythm research
@@ -153,8 +1941,21 @@ def calculate_circadian_rhythm():
         'chronotype_guess': 'intermediate'  # Could be extended with questionnaire
     }
 
-def analyze_productivity_pattern(weather, moon, circadian, location):
-    """Combine all factors to predict optimal schedule"""
+@functools.lru_cache(maxsize=256)
+def hour_context(local_hour):
+    """Moon and circadian context for one local wall-clock hour, shared by every zone at that hour.
+
+    The dicts are shared between requests - read them, don't modify them.
+    """
+    return get_moon_phase(local_hour), calculate_circadian_rhythm(local_hour)
+
+def local_context(location, now=None):
+    """(local time, moon, circadian) on the location's own clock"""
+    now = local_time(location.get('timezone')) if now is None else now
+    return (now,) + hour_context(now.replace(minute=0, second=0, microsecond=0))
+
+def environment_factors(weather):
+    """Weather and temperature multipliers - each takes only a handful of values"""
     
     # Weather influence on mood and energy
     weather_factor = 1.0
@@ -171,17 +1972,21 @@ def analyze_productivity_pattern(weather, moon, circadian, location):
     elif weather['temperature'] < 10 or weather['temperature'] > 30:
         temp_factor = 0.85
     
+    return weather_factor, temp_factor
+
+def compute_hourly_predictions(weather_factor, temp_factor, influence, start_hour):
+    """The 24-hour prediction rows starting at start_hour, computed from scratch"""
+    
     # Moon influence
-    moon_focus = moon['influence']['focus'] / 100
-    moon_creativity = moon['influence']['creativity'] / 100
-    moon_social = moon['influence']['social'] / 100
+    moon_focus = influence['focus'] / 100
+    moon_creativity = influence['creativity'] / 100
+    moon_social = influence['social'] / 100
     
     # Calculate optimal activities for next 24 hours
-    now = datetime.now()
     hourly_predictions = []
     
     for i in range(24):
-        hour = (now.hour + i) % 24
+        hour = (start_hour + i) % 24
         
         # Base circadian energy
         mental = 50 + 35 * math.sin((hour - 10) * math.pi / 12)
@@ -223,8 +2028,145 @@ def analyze_productivity_pattern(weather, moon, circadian, location):
             'confidence': round(max(scores.values()), 1)
         })
     
-    # Generate insights
-    insights = generate_insights(hourly_predictions, weather, moon, location)
+    return hourly_predictions
+
+# ══════════════════════════════════════════════════════════════════════════════
+# VECTORIZED ENGINE - NumPy scoring across hours x locations x days
+# ══════════════════════════════════════════════════════════════════════════════
+
+PREDICTION_ENGINE = os.environ.get('PREDICTION_ENGINE', 'scalar')   # 'scalar' or 'numpy'
+
+ACTIVITIES = ('Deep Work', 'Creative Tasks', 'Exercise', 'Socializing', 'Rest')
+
+def predict_matrix(weather_factor, temp_factor, focus, creativity, social, start_hour):
+    """Score N entities (locations, days, or both) for 24 hours in one pass.
+
+    Each argument is a scalar or a length-N sequence. Returns (N, 24) arrays for
+    hour, mental, physical, creative, social, activity (index into ACTIVITIES) and
+    confidence, plus the clamp masks prediction_rows_from_matrix needs to
+    reproduce compute_hourly_predictions exactly.
+    """
+    weather_factor, temp_factor, focus, creativity, social, start_hour = (
+        a[:, None] for a in np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(x, dtype=float))
+              for x in (weather_factor, temp_factor, focus, creativity, social, start_hour))
+        )
+    )
+    hours = (start_hour.astype(np.int64) + np.arange(24)) % 24
+    h = hours.astype(float)
+
+    # Same operation order as the scalar loop, so results are bit-identical
+    raw = {
+        'mental':   (50 + 35 * np.sin((h - 10) * math.pi / 12)) * (weather_factor * (focus / 100) * temp_factor),
+        'physical': (50 + 40 * np.sin((h - 17) * math.pi / 12)) * (weather_factor * temp_factor),
+        'creative': (50 + 30 * np.sin((h - 14) * math.pi / 12)) * (weather_factor * (creativity / 100) * temp_factor),
+        'social':   (50 + 35 * np.sin((h - 19) * math.pi / 12)) * (weather_factor * (social / 100) * temp_factor),
+    }
+    result = {'hour': hours}
+    for name, values in raw.items():
+        result[name] = np.clip(values, 0, 100)
+        result[name + '_clamped'] = (values < 0) | (values > 100)
+
+    scores = np.stack([result['mental'], result['creative'], result['physical'], result['social'],
+                       100 - (result['mental'] + result['physical']) / 2])
+    result['activity'] = scores.argmax(axis=0)
+    result['confidence'] = np.take_along_axis(scores, result['activity'][None], axis=0)[0]
+    return result
+
+def prediction_rows_from_matrix(result, i):
+    """Entity i of a predict_matrix result as the scalar engine's list of row dicts"""
+    columns = {name: result[name][i].tolist()
+               for name in ('hour', 'mental', 'physical', 'creative', 'social', 'activity', 'confidence',
+                            'mental_clamped', 'physical_clamped', 'creative_clamped', 'social_clamped')}
+    # The scalar clamp yields int 0/100, which serialise without a decimal point
+    fields = ('mental', 'creative', 'physical', 'social')
+    rows = []
+    for j, hour in enumerate(columns['hour']):
+        row = {'hour': hour, 'time': f"{hour:02d}:00"}
+        values = {}
+        for name in ('mental', 'physical', 'creative', 'social'):
+            value = columns[name][j]
+            values[name] = int(value) if columns[name + '_clamped'][j] else value
+            row[name] = round(values[name], 1)
+        activity = columns['activity'][j]
+        row['recommended_activity'] = ACTIVITIES[activity]
+        row['confidence'] = round(values[fields[activity]] if activity < 4 else columns['confidence'][j], 1)
+        rows.append(row)
+    return rows
+
+def predict_many(entities, engine=None):
+    """Predictions for many (weather_factor, temp_factor, influence, start_hour) tuples"""
+    engine = engine or PREDICTION_ENGINE
+    if engine == 'scalar':
+        return [compute_hourly_predictions(*entity) for entity in entities]
+    if not entities:
+        return []
+    result = predict_matrix(*zip(*((wf, tf, inf['focus'], inf['creativity'], inf['social'], start)
+                                   for wf, tf, inf, start in entities)))
+    return [prediction_rows_from_matrix(result, i) for i in range(len(entities))]
+
+def set_prediction_engine(engine):
+    """Switch between the scalar and NumPy engines at runtime and rebuild the tables"""
+    global PREDICTION_ENGINE
+    if engine not in ('scalar', 'numpy'):
+        raise ValueError(f'Unknown prediction engine: {engine}')
+    if engine == 'numpy' and np is None:
+        raise RuntimeError('The numpy prediction engine needs numpy: pip install -r requirements-extras.txt')
+    PREDICTION_ENGINE = engine
+    _prediction_rows.clear()
+    prediction_table.cache_clear()
+    warm_prediction_tables()
+
+_prediction_rows = {}
+
+def prediction_rows(weather_factor, temp_factor, focus, creativity, social):
+    """Memoized rows for hours 00-23 - a row doesn't depend on where the day starts"""
+    key = (weather_factor, temp_factor, focus, creativity, social)
+    rows = _prediction_rows.get(key)
+    if rows is None:
+        influence = {'focus': focus, 'creativity': creativity, 'social': social}
+        rows = _prediction_rows[key] = tuple(predict_many([(weather_factor, temp_factor, influence, 0)])[0])
+    return rows
+
+@functools.lru_cache(maxsize=4096)
+def prediction_table(weather_factor, temp_factor, focus, creativity, social, start_hour):
+    """Memoized predictions plus peak-time insights for one combination of model inputs.
+
+    The model only sees 4 weather factors x 3 temperature factors x 8 moon phases
+    x 24 start hours, so every request after warm-up is a lookup.
+    """
+    rows = prediction_rows(weather_factor, temp_factor, focus, creativity, social)
+    predictions = rows[start_hour:] + rows[:start_hour]
+    return predictions, tuple(peak_insights(predictions))
+
+def warm_prediction_tables():
+    """Fill prediction_table for every reachable input combination"""
+    combos = [(weather_factor, temp_factor, influence)
+              for weather_factor in (1.0, 1.1, 0.9, 0.7)
+              for temp_factor in (1.0, 1.1, 0.85)
+              for influence in MOON_INFLUENCE.values()]
+    # One predict_many call, so the numpy engine scores every combination at once
+    all_rows = predict_many([(wf, tf, influence, 0) for wf, tf, influence in combos])
+    for (weather_factor, temp_factor, influence), rows in zip(combos, all_rows):
+        key = (weather_factor, temp_factor, influence['focus'], influence['creativity'], influence['social'])
+        _prediction_rows[key] = tuple(rows)
+        for start_hour in range(24):
+            prediction_table(*key, start_hour)
+
+def analyze_productivity_pattern(weather, moon, circadian, location, hour=None):
+    """Combine all factors to predict optimal schedule, starting at the location's current hour"""
+    with stage('model'):
+        weather_factor, temp_factor = environment_factors(weather)
+        influence = moon['influence']
+        if hour is None:
+            hour = local_time(location.get('timezone')).hour
+        predictions, peaks = prediction_table(weather_factor, temp_factor, influence['focus'],
+                                              influence['creativity'], influence['social'], hour)
+    
+    # Table rows and peak insights are shared between requests - hand out new lists only
+    hourly_predictions = list(predictions)
+    with stage('insights'):
+        insights = list(peaks) + situational_insights(weather, moon, location)
     
     return {
         'hourly_predictions': hourly_predictions,
@@ -239,6 +2181,10 @@ def analyze_productivity_pattern(weather, moon, circadian, location):
 
 def generate_insights(predictions, weather, moon, location):
     """Generate personalized insights and recommendations"""
+    return peak_insights(predictions) + situational_insights(weather, moon, location)
+
+def peak_insights(predictions):
+    """Insights that depend only on the prediction rows"""
     
     # Find peak hours
     peak_mental = max(predictions, key=lambda x: x['mental'])
@@ -277,6 +2223,12 @@ def generate_insights(predictions, weather, moon, location):
         'confidence': 90
     })
     
+    return insights
+
+def situational_insights(weather, moon, location):
+    """Insights that depend on the location's weather and the moon"""
+    insights = []
+    
     # Insight 4: Weather impact
     if weather['condition'] in ['Clear sky', 'Mainly clear']:
         insights.append({
@@ -349,94 +2301,1104 @@ def get_random_productivity_tip():
     ]
     return random.choice(tips)
 
+# ══════════════════════════════════════════════════════════════════════════════
+# BACKGROUND REFRESH - Keep hot weather cells warm so they never cold-miss
+# ══════════════════════════════════════════════════════════════════════════════
+
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 2))                  # 0 disables background refresh
+REFRESH_AHEAD_SECONDS = int(os.environ.get('REFRESH_AHEAD_SECONDS', 300))    # prefetch this long before expiry
+REFRESH_BUDGET_PER_MINUTE = int(os.environ.get('REFRESH_BUDGET_PER_MINUTE', 30))
+REFRESH_HOT_HITS = int(os.environ.get('REFRESH_HOT_HITS', 3))                # requests per period to count as hot
+REFRESH_INTERVAL = 30                                                       # seconds between hot-cell scans
+
+class WeatherRefresher:
+    """Tracks request counts per cell and re-fetches hot cells just before their period ends"""
+
+    def __init__(self, workers=REFRESH_WORKERS, budget_per_minute=REFRESH_BUDGET_PER_MINUTE):
+        self.workers = workers
+        self.budget_per_minute = budget_per_minute
+        self.refreshed = 0
+        self.skipped_budget = 0
+        self._counts = {}           # cell -> (bucket, requests in that bucket, requests in the one before)
+        self._pending = set()
+        self._window = (0, 0)       # (minute, upstream fetches spent in it)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def touch(self, cell):
+        """Count a request for this cell in the current forecast period"""
+        self._ensure_started()
+        bucket = weather_bucket()[0]
+        with self._lock:
+            seen_bucket, count, previous = self._counts.get(cell, (bucket, 0, 0))
+            if seen_bucket != bucket:
+                previous = count if seen_bucket == bucket - 1 else 0
+                count = 0
+            self._counts[cell] = (bucket, count + 1, previous)
+
+    def hot_cells(self):
+        bucket = weather_bucket()[0]
+        with self._lock:
+            # Forget cells nobody asked for in the last two periods
+            for cell in [c for c, (b, _, _) in self._counts.items() if b < bucket - 1]:
+                del self._counts[cell]
+            return [cell for cell, (b, count, previous) in self._counts.items()
+                    if max(count, previous) >= REFRESH_HOT_HITS]
+
+    def _take_budget(self):
+        minute = int(time.time() // 60)
+        with self._lock:
+            window_minute, spent = self._window
+            if window_minute != minute:
+                spent = 0
+            if spent >= self.budget_per_minute:
+                self.skipped_budget += 1
+                return False
+            self._window = (minute, spent + 1)
+            return True
+
+    def schedule(self, cell, bucket):
+        """Queue a background fill of (cell, bucket) - True if one is now pending, False if refreshes are off or over budget"""
+        if not self._ensure_started():
+            return False
+        with self._lock:
+            if (cell, bucket) in self._pending:
+                return True
+        if not self._take_budget():
+            return False
+        with self._lock:
+            self._pending.add((cell, bucket))
+        self._executor.submit(self._refresh, cell, bucket)
+        return True
+
+    def _refresh(self, cell, bucket):
+        upstream_priority.set('background')     # this pool thread only ever refreshes
+        try:
+            fill_weather(cell, bucket)
+            self.refreshed += 1
+        except RateLimitedError:
+            pass                                # spare quota ran out; the request path will fetch it
+        except UpstreamError as e:
+            logger.warning('Background refresh of %s failed: %s', cell, e)
+        finally:
+            with self._lock:
+                self._pending.discard((cell, bucket))
+
+    def scan(self):
+        """Prefetch next period's weather for hot cells whose current entry is about to expire"""
+        bucket, ends_at = weather_bucket()
+        if ends_at - time.time() > REFRESH_AHEAD_SECONDS:
+            return
+        for cell in self.hot_cells():
+            if weather_cache.peek((cell, bucket + 1)) is None:
+                self.schedule(cell, bucket + 1)
+
+    def _loop(self):
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            try:
+                self.scan()
+            except Exception:
+                logger.exception('Weather refresh scan failed')
+
+    def _ensure_started(self):
+        """Start the worker pool and scan thread lazily, once per (forked) worker process"""
+        if self.workers <= 0:
+            return False
+        if self._pid == os.getpid():
+            return True
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='weather-refresh')
+                threading.Thread(target=self._loop, name='weather-refresh-scan', daemon=True).start()
+                self._pid = os.getpid()
+        return True
+
+    def stats(self):
+        return {
+            'hot_cells': len(self.hot_cells()),
+            'pending': len(self._pending),
+            'refreshed': self.refreshed,
+            'skipped_budget': self.skipped_budget
+        }
+
+weather_refresher = WeatherRefresher()
+
+set_prediction_engine(PREDICTION_ENGINE)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# WARM RESTART - snapshot the caches to disk, restore them on boot
+# ══════════════════════════════════════════════════════════════════════════════
+
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', '')                  # unset = no snapshots
+SNAPSHOT_SECONDS = int(os.environ.get('SNAPSHOT_SECONDS', 300))      # between periodic snapshots
+
+def _tuplify(value):
+    """JSON turns tuple cache keys into lists - turn them back"""
+    return tuple(_tuplify(v) for v in value) if isinstance(value, list) else value
+
+class CacheSnapshotter:
+    """Writes the warm caches to one file periodically and at exit, and loads them back on boot.
+
+    Layout: magic, written-at time and payload length (struct header), then zlib-compressed JSON
+    of every cache's (key, value, expires_at, stored_at) entries plus the timezones in use.
+    Workers merge into the same file under an flock on <path>.lock, so it holds the union of what they have warmed.
+    """
+
+    MAGIC = b'LPASNAP1'
+    HEADER = struct.Struct('<8sdI')
+
+    def __init__(self, path, caches, grace):
+        self.path = path
+        self.caches = caches            # name -> LRUCache
+        self.grace = grace              # name -> seconds an expired entry is still worth keeping
+        self.saved_at = None
+        self.restored_at = None
+        self.restored = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _read(self):
+        """(written_at, contents) of the snapshot file, or None if there's no usable one"""
+        try:
+            with open(self.path, 'rb') as f:
+                magic, written_at, length = self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic != self.MAGIC:
+                    raise ValueError('not a cache snapshot')
+                return written_at, json.loads(zlib.decompress(f.read(length)))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error, zlib.error) as e:
+            self.errors += 1
+            logger.warning('Ignoring cache snapshot %s: %s', self.path, e)
+            return None
+
+    def _live(self, name, entries, now):
+        return [(_tuplify(key), value, expires_at, stored_at) for key, value, expires_at, stored_at in entries
+                if expires_at + self.grace.get(name, 0) > now]
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the snapshot's lock file, so two workers' read-merge-write can't drop each other's entries"""
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.path}.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self):
+        """Merge this process's caches into the snapshot file, atomically"""
+        try:
+            with self._lock, self._file_lock():
+                self._merge()
+        except (OSError, TypeError, ValueError) as e:
+            self.errors += 1
+            logger.warning('Cache snapshot to %s failed: %s', self.path, e)
+
+    def _merge(self):
+        now = time.time()
+        previous = self._read()
+        saved = previous[1] if previous else {}
+        contents = {'caches': {}, 'zones': sorted(set(_zone_offsets) | set(saved.get('zones', [])))}
+        for name, cache in self.caches.items():
+            merged = {}
+            entries = self._live(name, saved.get('caches', {}).get(name, []), now) + cache.entries()
+            for key, value, expires_at, stored_at in entries:
+                if key not in merged or stored_at >= merged[key][3]:
+                    merged[key] = (key, value, expires_at, stored_at)
+            live = sorted(self._live(name, merged.values(), now), key=lambda entry: entry[3])
+            contents['caches'][name] = live[-cache.maxsize:]
+        payload = zlib.compress(json.dumps(contents, separators=(',', ':')).encode(), 6)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, now, len(payload)) + payload)
+        os.replace(tmp, self.path)
+        self.saved_at = now
+
+    def restore(self):
+        """Load a previous snapshot, keeping each entry's original expiry"""
+        snapshot = self._read()
+        if snapshot is None:
+            return
+        now = time.time()
+        for name, cache in self.caches.items():
+            entries = self._live(name, snapshot[1].get('caches', {}).get(name, []), now)
+            cache.restore(entries)
+            self.restored[name] = len(entries)
+        for zone in snapshot[1].get('zones', []):
+            utc_offset(zone, now)       # rebuild the zone's offset table now, not on the first request
+        self.restored_at = now
+        logger.info('Restored cache snapshot from %s (%s)', self.path, self.restored)
+
+    def _loop(self):
+        while True:
+            time.sleep(SNAPSHOT_SECONDS)
+            self.save()
+
+    def ensure_started(self):
+        """Start the periodic snapshot thread and the at-exit save, once per (forked) worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._loop, name='cache-snapshot', daemon=True).start()
+                atexit.register(self.save)
+                self._pid = os.getpid()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'saved_at': self.saved_at,
+            'restored_at': self.restored_at,
+            'restored': self.restored,
+            'errors': self.errors,
+        }
+
+snapshotter = CacheSnapshotter(SNAPSHOT_FILE, {'weather': weather_cache, 'geocode': geocode_cache},
+                               {'weather': WEATHER_STALE_SECONDS})
+if SNAPSHOT_FILE:
+    snapshotter.restore()
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ON-DEMAND PROFILING - one request at a time, only with the shared token
+# ══════════════════════════════════════════════════════════════════════════════
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')       # unset = profiling disabled
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')           # set = store profiles here instead of inlining
+PROFILE_TOP = 30                                          # rows in the inline report
+
+_profile_lock = threading.Lock()
+
+def start_profile():
+    """Begin a cProfile ('cpu') or tracemalloc ('memory') capture for this request"""
+    mode = request.headers.get('X-Profile', 'cpu')
+    token = request.headers.get('X-Profile-Token', '')
+    if mode not in ('cpu', 'memory') or not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+        return
+    # Both profilers are process-wide in practice, so capture one request at a time
+    if not _profile_lock.acquire(blocking=False):
+        g.profile_status = 'busy'
+        return
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        tracemalloc.start(25)
+        profiler = tracemalloc.take_snapshot()
+    g.profile = (mode, profiler)
+
+def stop_profile(profile):
+    """Detach the profiler and return its report as (text, raw object to store)"""
+    mode, profiler = profile
+    try:
+        if mode == 'cpu':
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            return out.getvalue(), profiler
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        top = snapshot.compare_to(profiler, 'lineno')[:PROFILE_TOP]
+        return '\n'.join(str(stat) for stat in top), snapshot
+    finally:
+        _profile_lock.release()
+
+def finish_profile(response):
+    """Store the capture under PROFILE_DIR, or inline its report into a JSON response"""
+    mode, _ = g.profile
+    report, raw = stop_profile(g.pop('profile'))
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{request.endpoint}.{'prof' if mode == 'cpu' else 'tracemalloc'}"
+        path = os.path.join(PROFILE_DIR, name)
+        if mode == 'cpu':
+            raw.dump_stats(path)
+        else:
+            raw.dump(path)
+        response.headers['X-Profile-Saved'] = path
+    elif response.is_json:
+        data = response.get_json()
+        data['profile'] = {'mode': mode, 'report': report}
+        response.set_data(app.json.dumps(data))
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TRAFFIC CAPTURE - opt-in log of /api/analyze traffic for `benchmark.py replay`
+# ══════════════════════════════════════════════════════════════════════════════
+
+CAPTURE_FILE = os.environ.get('CAPTURE_FILE', '')                # unset = capture off; *.gz = compressed
+CAPTURE_SAMPLE = float(os.environ.get('CAPTURE_SAMPLE', '1'))    # fraction of requests recorded
+
+# Upstream exchanges made on behalf of the request being captured; None when not capturing
+capture_exchanges = ContextVar('capture_exchanges', default=None)
+
+def record_exchange(upstream, path, params, started, data=None, error=None):
+    """Note an upstream answer (or final error) against the request being captured, if any"""
+    exchanges = capture_exchanges.get()
+    if exchanges is None:
+        return
+    exchange = {'upstream': upstream, 'path': path, 'params': params or {},
+                'ms': round((time.perf_counter() - started) * 1000, 1)}
+    if error is None:
+        exchange['data'] = data
+    else:
+        exchange['error'] = error
+    exchanges.append(exchange)
+
+def request_kind(body):
+    """Which location source resolve_location() will use for this body"""
+    if body.get('lat') and body.get('lon'):
+        return 'gps'
+    return 'city' if body.get('city') else 'ip'
+
+class CaptureLog:
+    """Append-only JSON-lines log, one write() per record so forked workers can share the file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self.errors = 0
+        self._fd = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Begin capturing the current request, subject to CAPTURE_SAMPLE - returns a reset token"""
+        if not self.path or random.random() >= CAPTURE_SAMPLE:
+            return None
+        return capture_exchanges.set([])
+
+    def finish(self, body, status, response, started):
+        """Queue the record for the current request; encoding and disk I/O stay off the request path"""
+        record = {
+            't': round(time.time(), 3),
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+            'kind': request_kind(body),
+            'body': body,
+            'status': status,
+            'response': response,
+            'upstream': capture_exchanges.get() or [],
+        }
+        self._ensure_started()
+        self._executor.submit(self._write, record)
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode() + b'\n'
+        if self.path.endswith('.gz'):
+            line = gzip.compress(line)    # concatenated gzip members still read as one stream
+        try:
+            os.write(self._fd, line)
+            self.records += 1
+        except OSError as e:
+            self.errors += 1
+            logger.warning('Capture write failed: %s', e)
+
+    def _ensure_started(self):
+        """Open the file and start the writer thread lazily, once per (forked) worker process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='capture')
+                self._pid = os.getpid()
+
+    def stats(self):
+        return {'enabled': bool(self.path), 'file': self.path, 'sample': CAPTURE_SAMPLE,
+                'records': self.records, 'errors': self.errors}
+
+capture_log = CaptureLog(CAPTURE_FILE)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# ADMISSION CONTROL - per-client rate limits, fair queuing and load shedding
+# ══════════════════════════════════════════════════════════════════════════════
+
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8))   # in-flight per worker process; 0 = off
+ADMISSION_QUEUE_SECONDS = float(os.environ.get('ADMISSION_QUEUE_SECONDS', 2))   # longest a request may wait for a slot
+CLIENT_RATE = float(os.environ.get('CLIENT_RATE', 1 if TRUSTED_PROXIES else 0))  # sustained requests/second per client; 0 = unlimited
+CLIENT_BURST = float(os.environ.get('CLIENT_BURST', 10))                         # requests a client may send at once
+CLIENT_MAX_QUEUED = int(os.environ.get('CLIENT_MAX_QUEUED', 4))                  # waiting requests per client
+ADMISSION_CLIENTS = 10000                                                       # clients whose budgets we remember
+ADMISSION_ENDPOINTS = {'analyze', 'analyze_batch'}
+API_KEY_HEADER = 'X-API-Key'
+API_KEYS = [key.strip().encode() for key in os.environ.get('API_KEYS', '').split(',') if key.strip()]   # issued keys with their own budgets
+
+class Rejected(Exception):
+    """A request turned away before doing any work, with its status and Retry-After seconds"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+    def payload(self):
+        message = ('Too many requests from this client.' if self.status == 429 else
+                   'The server is busy.')
+        return {'success': False, 'error': f'{message} Retry in {self.retry_after}s.', 'reason': self.reason}
+
+class _Ticket:
+    __slots__ = ('granted', 'event', 'loop', 'future')
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(True))
+
+class AdmissionController:
+    """Per-client token buckets in front of a global concurrency limit with round-robin queues.
+
+    A slot that frees up goes to the next client in rotation, not the next request, so one
+    client with many queued requests can't starve the rest. Requests that would wait longer
+    than ADMISSION_QUEUE_SECONDS are shed at once with 503 instead of timing out later.
+    """
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, queue_seconds=ADMISSION_QUEUE_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.queue_seconds = queue_seconds
+        self.active = 0
+        self.queued = 0
+        self.service_time = 0.05     # moving average of admitted request durations (s)
+        self.admitted = 0
+        self.rejected = dict.fromkeys(('rate', 'client_queue', 'overload', 'timeout'), 0)
+        self._queues = OrderedDict()     # client -> deque of tickets, in round-robin order
+        self._budgets = OrderedDict()    # client -> (tokens, updated), least recently seen first
+        self._lock = threading.Lock()
+
+    def _reject(self, status, retry_after, reason):
+        self.rejected[reason] += 1
+        return Rejected(status, retry_after, reason)
+
+    def _take_token(self, client, now):
+        if CLIENT_RATE <= 0:
+            return
+        tokens, updated = self._budgets.pop(client, (CLIENT_BURST, now))
+        tokens = min(CLIENT_BURST, tokens + (now - updated) * CLIENT_RATE)
+        if tokens < 1:
+            self._budgets[client] = (tokens, now)
+            raise self._reject(429, (1 - tokens) / CLIENT_RATE, 'rate')
+        self._budgets[client] = (tokens - 1, now)
+        if len(self._budgets) > ADMISSION_CLIENTS:
+            self._budgets.popitem(last=False)
+
+    def _admit(self, client, ticket):
+        """Under the lock: True if admitted now, False if queued; raises Rejected"""
+        self._take_token(client, time.monotonic())
+        if self.active < self.max_concurrent and not self._queues:
+            self.active += 1
+            self.admitted += 1
+            return True
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= CLIENT_MAX_QUEUED:
+            raise self._reject(429, self.service_time * len(queue), 'client_queue')
+        expected = (self.queued + 1) * self.service_time / self.max_concurrent
+        if expected > self.queue_seconds:
+            raise self._reject(503, expected, 'overload')
+        self._queues.setdefault(client, deque()).append(ticket)
+        self.queued += 1
+        return False
+
+    def _dispatch(self):
+        """Under the lock: hand free slots to the next clients in rotation"""
+        while self.active < self.max_concurrent and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self.queued -= 1
+            self.active += 1
+            self.admitted += 1
+            ticket.wake()
+
+    def _abandon(self, client, ticket):
+        """Under the lock: take a ticket that timed out or was cancelled out of its queue"""
+        queue = self._queues.get(client)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self._queues[client]
+
+    def enter(self, client):
+        """Block until the request may run; raises Rejected if it shouldn't wait or waited too long"""
+        ticket = _Ticket()
+        with self._lock:
+            if self._admit(client, ticket):
+                return
+        if ticket.event.wait(self.queue_seconds):
+            return
+        with self._lock:
+            if ticket.granted:          # granted just as we gave up
+                return
+            self._abandon(client, ticket)
+            raise self._reject(503, self.queue_seconds, 'timeout')
+
+    async def enter_async(self, client):
+        """enter() for the event loop"""
+        ticket = _Ticket(asyncio.get_running_loop())
+        with self._lock:
+            if self._admit(client, ticket):
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if ticket.granted:
+                    if isinstance(e, asyncio.TimeoutError):
+                        return
+                    self._release()     # cancelled after being granted - give the slot back
+                    raise
+                self._abandon(client, ticket)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject(503, self.queue_seconds, 'timeout')
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def leave(self, started):
+        """An admitted request finished - record how long it took and pass its slot on"""
+        with self._lock:
+            self.service_time += 0.1 * ((time.perf_counter() - started) - self.service_time)
+            self._release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'active': self.active,
+                'queued': self.queued,
+                'queued_clients': len(self._queues),
+                'service_time_ms': round(self.service_time * 1000, 1),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+            }
+
+admission = AdmissionController()
+
+def client_key(api_key, ip):
+    """Whose budget a request spends: an issued API key if it sent one, else its address.
+
+    Unknown keys are ignored, so made-up keys can neither dodge the limit nor crowd out real budgets.
+    """
+    if api_key:
+        presented = api_key.encode()
+        for number, key in enumerate(API_KEYS):
+            if hmac.compare_digest(presented, key):
+                return f'key:{number}'
+    return f'ip:{ip}'
+
+def rejected_response(e):
+    response = jsonify(e.payload())
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 # ══════════════════════════════════════════════════════════════════════════════
 # API ENDPOINTS
 # ══════════════════════════════════════════════════════════════════════════════
 
+@app.before_request
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.timings_token = request_timings.set({})
+    if request.endpoint in DEADLINES:
+        g.deadline_token = start_deadline(request.headers.get(DEADLINE_HEADER), DEADLINES[request.endpoint])
+    REQUESTS_IN_FLIGHT.inc(request.endpoint or 'unknown')
+    if SNAPSHOT_FILE:
+        snapshotter.ensure_started()
+    if CAPTURE_FILE and request.endpoint == 'analyze':
+        g.capture_token = capture_log.start()
+    if PROFILE_TOKEN and 'X-Profile' in request.headers:
+        start_profile()
+
+@app.before_request
+def _admit_request():
+    """Queue or shed the expensive endpoints before they tie up this worker"""
+    if not ADMISSION_MAX_CONCURRENT or request.endpoint not in ADMISSION_ENDPOINTS:
+        return None
+    try:
+        admission.enter(client_key(request.headers.get(API_KEY_HEADER),
+                                   client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))))
+    except Rejected as e:
+        return rejected_response(e)
+    g.admitted_at = time.perf_counter()
+
+@app.after_request
+def _count_request(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS_TOTAL.inc(endpoint, str(response.status_code))
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint)
+    timings = request_timings.get()
+    if timings:
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    if g.get('capture_token') is not None:
+        capture_log.finish(request.get_json(silent=True) or {}, response.status_code,
+                           response.get_json(silent=True), g.request_started)
+    if g.get('profile') is not None:
+        finish_profile(response)
+    elif 'profile_status' in g:
+        response.headers['X-Profile-Status'] = g.profile_status
+    return response
+
+@app.teardown_request
+def _end_request(exc):
+    REQUESTS_IN_FLIGHT.dec(request.endpoint or 'unknown')
+    if g.get('admitted_at') is not None:
+        admission.leave(g.admitted_at)
+    if 'timings_token' in g:
+        request_timings.reset(g.timings_token)
+    if 'deadline_token' in g:
+        request_deadline.reset(g.deadline_token)
+    if g.get('capture_token') is not None:
+        capture_exchanges.reset(g.capture_token)
+    if g.get('profile') is not None:
+        # after_request didn't run (unhandled error) - don't leave a profiler attached
+        stop_profile(g.pop('profile'))
+
 @app.route('/')
 def home():
     return HTML_TEMPLATE
 
+class AnalysisError(Exception):
+    """A request that can't be analyzed, with the HTTP status to answer it with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def gps_point(body):
+    try:
+        lat, lon = float(body['lat']), float(body['lon'])
+    except (TypeError, ValueError):
+        raise AnalysisError('Coordinates must be numbers.')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise AnalysisError('Coordinates are out of range.')
+    return lat, lon
+
+def coordinates_label(lat, lon):
+    return f"{abs(lat):.2f}°{'N' if lat >= 0 else 'S'}, {abs(lon):.2f}°{'E' if lon >= 0 else 'W'}"
+
+def gps_location(body, lat, lon, place=None):
+    """Option 1: the browser sent GPS coordinates - named by `place` (bundled or Nominatim), else by the coordinates.
+
+    The browser's own timezone wins over the bundled place's, then over one estimated from the coordinates.
+    """
+    place = place or {}
+    zone = body.get('timezone')
+    return {
+        'city': body.get('city') or place.get('city') or coordinates_label(lat, lon),
+        'region': place.get('region', ''),
+        'country': body.get('country') or place.get('country', ''),
+        'lat': lat,
+        'lon': lon,
+        'timezone': zone if known_zone(zone) else place.get('timezone') or solar_timezone(lon),
+        'isp': 'GPS',
+        'source': '📍 GPS (exact)'
+    }
+
+def manual_location(city_name, r):
+    """Option 2: the user typed a city and the geocoder found it as r"""
+    if r is None:
+        hint, _ = gazetteer.suggest(city_name, limit=1)
+        raise AnalysisError(f'City "{city_name}" not found. ' +
+                            (f'Did you mean {hint[0]["name"]}?' if hint else 'Try a different spelling.'))
+    return {
+        'city':     r.get('name', city_name),
+        'country':  r.get('country', ''),
+        'lat':      r['latitude'],
+        'lon':      r['longitude'],
+        'timezone': r.get('timezone', 'UTC'),
+        'isp':      'Manual',
+        'source':   '🔍 Manual entry'
+    }
+
+def geocoding_unavailable(e):
+    logger.warning('Geocoding unavailable: %s', e)
+    FALLBACKS.inc('geocode')
+    return AnalysisError('City search is temporarily unavailable. Please try again shortly.', 503)
+
+@contextmanager
+def resolving(kind):
+    """Time a city or IP lookup as its stage; a failed geocode becomes a 503"""
+    try:
+        with stage('geocode' if kind == 'city' else 'location'):
+            yield
+    except UpstreamError as e:
+        raise geocoding_unavailable(e)
+
+def ip_sourced(location):
+    location['source'] = '🌐 IP (approximate)'
+    return location
+
+def resolve_location(body, ip=None):
+    """Pick the location source for a request: GPS, typed city, or the client IP as fallback"""
+    kind = request_kind(body)
+    if kind == 'gps':
+        with stage('geocode'):
+            lat, lon = gps_point(body)
+            place = reverse_geocode(lat, lon) or {}
+            if not place.get('city') and not body.get('city'):
+                place = dict(place, **(remote_place(lat, lon) or {}))
+            return gps_location(body, lat, lon, place)
+    with resolving(kind):
+        if kind == 'city':
+            return manual_location(body['city'], geocode_city(body['city']))
+        return ip_sourced(get_ip_location(ip))
+
+def degraded_parts(location, weather):
+    """Which parts of an analysis rest on fallbacks rather than fresh upstream answers"""
+    parts = [name for name, part in (('location', location), ('weather', weather)) if part.get('degraded')]
+    if 'hourly' in weather and not weather['hourly']:
+        parts.append('hourly')
+    return parts
+
+def build_analysis(location, weather, now=None):
+    """Run the model for a resolved location and weather - the /api/analyze payload"""
+    with stage('context'):
+        now, moon, circadian = local_context(location, now)
+    analysis  = analyze_productivity_pattern(weather, moon, circadian, location, now.hour)
+
+    return {
+        'success':   True,
+        'timestamp': datetime.now().isoformat(),
+        'local_time': now.isoformat(timespec='minutes'),
+        'location':  location,
+        'weather':   weather,
+        'moon':      moon,
+        'circadian': circadian,
+        'analysis':  analysis,
+        'tip':       get_random_productivity_tip(),
+        'degraded':  degraded_parts(location, weather)
+    }
+
+# Holes in a response template; the marker text never occurs in a real payload
+_SPLICE = re.compile(r'"@@lpa:(\w+)@@"|@@lpa:(\w+)@@')
+
+def hole(name):
+    return f'@@lpa:{name}@@'
+
+class ResponseTemplate:
+    """A serialized /api/analyze payload with holes for the fields that differ between requests.
+
+    Whole-value holes ("tip", "location", ...) are filled with the value's JSON; the city and
+    country names inside insight and factor strings are filled as escaped string content.
+    """
+
+    def __init__(self, payload):
+        # split() with two groups yields literal, value hole, inline hole, literal, ...
+        parts = _SPLICE.split(app.json.dumps(payload))
+        self.literals = [part.encode() for part in parts[::3]]
+        self.holes = list(zip(parts[1::3], parts[2::3]))
+
+    def render(self, fields):
+        out = [self.literals[0]]
+        for (value, inline), literal in zip(self.holes, self.literals[1:]):
+            out.append((app.json.dumps(fields[value]) if value else app.json.dumps(fields[inline])[1:-1]).encode())
+            out.append(literal)
+        return b''.join(out)
+
+def response_template(location, weather, now):
+    """Run the model once with every per-request field left as a hole"""
+    payload = build_analysis(dict(location, city=hole('city'), country=hole('country')), weather, now)
+    payload.update({name: hole(name) for name in ('timestamp', 'local_time', 'location', 'tip', 'degraded')})
+    return ResponseTemplate(payload)
+
+def analysis_response(location, weather):
+    """The /api/analyze body as JSON bytes - model output and encoding reused per (cell, timezone, local hour).
+
+    Only fresh cached weather is reused; an entry dies with the weather object it was built from,
+    so a refresh of the cell invalidates it.
+    """
+    now = local_time(location.get('timezone'))
+    cell = weather_cell(location['lat'], location['lon'])
+    source = None
+    if not (weather.get('stale') or weather.get('degraded') or 'hourly' in weather):
+        source = weather_cache.peek((cell, weather_bucket()[0]))
+    if source is None:
+        payload = build_analysis(location, weather, now)
+        with stage('serialize'):
+            return app.json.dumps(payload).encode()
+
+    key = (cell, location.get('timezone'), now.replace(minute=0, second=0, microsecond=0))
+    entry = response_cache.get(key, valid=lambda entry: entry[1] is source[0])
+    if entry is None:
+        entry = (response_template(location, weather, now), source[0])
+        response_cache.set(key, entry, time.time() + 3600 - now.minute * 60 - now.second)
+    with stage('serialize'):
+        return entry[0].render({
+            'city':       location['city'],
+            'country':    location['country'],
+            'timestamp':  datetime.now().isoformat(),
+            'local_time': now.isoformat(timespec='minutes'),
+            'location':   location,
+            'tip':        get_random_productivity_tip(),
+            'degraded':   degraded_parts(location, weather),
+        })
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     """Main analysis endpoint — accepts GPS coords or falls back to IP"""
     try:
         body = request.get_json(silent=True) or {}
+        location = resolve_location(body, client_ip(request.remote_addr, request.headers.get('X-Forwarded-For')))
+        with stage('weather'):
+            weather = get_weather(location['lat'], location['lon'])
+            if wants_hourly(body):
+                weather['hourly'] = get_hourly_forecast(location['lat'], location['lon'])
+        return Response(analysis_response(location, weather), mimetype='application/json')
+
+    except AnalysisError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except Exception as e:
+        logger.exception('Analysis failed')
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # ── Option 1: Browser sent GPS coordinates ──
-        if body.get('lat') and body.get('lon'):
-            lat = float(body['lat'])
-            lon = float(body['lon'])
-            city    = body.get('city', 'Your Location')
-            country = body.get('country', '')
-            timezone = body.get('timezone', 'UTC')
-            location = {
-                'city': city,
-                'country': country,
-                'lat': lat,
-                'lon': lon,
-                'timezone': timezone,
-                'isp': 'GPS',
-                'source': '📍 GPS (exact)'
-            }
-
-        # ── Option 2: User typed a city manually ──
-        elif body.get('city'):
-            city_name = body['city']
-            geo_url = f'https://geocoding-api.open-meteo.com/v1/search?name={city_name}&count=1&language=en&format=json'
-            geo_resp = requests.get(geo_url, timeout=5).json()
-            results  = geo_resp.get('results', [])
-            if not results:
-                return jsonify({'success': False, 'error': f'City "{city_name}" not found. Try a different spelling.'}), 400
-            r = results[0]
-            location = {
-                'city':     r.get('name', city_name),
-                'country':  r.get('country', ''),
-                'lat':      r['latitude'],
-                'lon':      r['longitude'],
-                'timezone': r.get('timezone', 'UTC'),
-                'isp':      'Manual',
-                'source':   '🔍 Manual entry'
-            }
-
-        # ── Option 3: Fallback — IP geolocation ──
-        else:
-            location = get_ip_location()
-            location['source'] = '🌐 IP (approximate)'
-
-        weather   = get_weather(location['lat'], location['lon'])
-        moon      = get_moon_phase()
-        circadian = calculate_circadian_rhythm()
-        analysis  = analyze_productivity_pattern(weather, moon, circadian, location)
+def batch_location(entry):
+    """Resolve one batch entry: coordinates as given, or a city name through the geocoder"""
+    if not isinstance(entry, dict):
+        raise AnalysisError('Each location must be an object with lat/lon or city.')
+    if entry.get('lat') is not None and entry.get('lon') is not None:
+        lat, lon = gps_point(entry)
+        location = gps_location(entry, lat, lon, reverse_geocode(lat, lon))
+        location.update(isp='Batch', source='📋 Batch')
+        return location
+    if entry.get('city'):
+        try:
+            return manual_location(entry['city'], geocode_city(entry['city']))
+        except UpstreamError as e:
+            raise geocoding_unavailable(e)
+    raise AnalysisError('Each location needs lat/lon or city.')
+
+def batch_locations(entries):
+    """Resolve every entry, a location or the exception it raised; remote city lookups run a few at a time.
+
+    Each lookup runs in a copy of this request's context, so the batch priority and deadline
+    apply to it; once the deadline passes, the remaining lookups fail fast instead of queueing.
+    """
+    def resolve(entry):
+        try:
+            return batch_location(entry)
+        except Exception as e:
+            return e
+
+    def is_remote(entry):
+        return (isinstance(entry, dict) and not (entry.get('lat') is not None and entry.get('lon') is not None)
+                and bool(entry.get('city')) and gazetteer.resolve(entry['city']) is None)
+
+    remote = {i for i, entry in enumerate(entries) if is_remote(entry)}
+    locations = [None if i in remote else resolve(entry) for i, entry in enumerate(entries)]
+    if remote:
+        with ThreadPoolExecutor(max_workers=min(BATCH_GEOCODE_WORKERS, len(remote))) as pool:
+            futures = {i: pool.submit(copy_context().run, resolve, entries[i]) for i in remote}
+        for i, future in futures.items():
+            locations[i] = future.result()
+    return locations
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many locations at once - weather is fetched per grid cell in bulk"""
+    priority = upstream_priority.set('batch')
+    try:
+        body = request.get_json(silent=True) or {}
+        entries = body.get('locations')
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'success': False, 'error': 'Send {"locations": [...]} with at least one location.'}), 400
+        if len(entries) > BATCH_MAX_LOCATIONS:
+            return jsonify({'success': False, 'error': f'At most {BATCH_MAX_LOCATIONS} locations per batch.'}), 400
+
+        locations = batch_locations(entries)
+
+        weather_by_cell = get_weather_many(
+            [(loc['lat'], loc['lon']) for loc in locations if isinstance(loc, dict)]
+        )
+        results = []
+        for index, location in enumerate(locations):
+            if isinstance(location, Exception):
+                results.append({'index': index, 'success': False, 'error': str(location)})
+                continue
+            try:
+                weather = weather_by_cell[weather_cell(location['lat'], location['lon'])]
+                now, local_moon, local_circadian = local_context(location)
+                results.append({
+                    'index':    index,
+                    'success':  True,
+                    'local_time': now.isoformat(timespec='minutes'),
+                    'location': location,
+                    'weather':  weather,
+                    'moon':     local_moon,
+                    'circadian': local_circadian,
+                    'analysis': analyze_productivity_pattern(weather, local_moon, local_circadian,
+                                                             location, now.hour),
+                    'degraded': ['weather'] if weather.get('degraded') else []
+                })
+            except Exception as e:
+                results.append({'index': index, 'success': False, 'error': str(e)})
 
         return jsonify({
             'success':   True,
             'timestamp': datetime.now().isoformat(),
-            'location':  location,
-            'weather':   weather,
-            'moon':      moon,
-            'circadian': circadian,
-            'analysis':  analysis,
-            'tip':       get_random_productivity_tip()
+            'count':     len(results),
+            'results':   results
         })
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        upstream_priority.reset(priority)
+
+def _runtime_metrics():
+    """Cache, coalescing, breaker and refresher state, read at scrape time"""
+    caches = {'weather': weather_cache.stats(), 'response': response_cache.stats(),
+              'geocode': geocode_cache.stats()}
+    flights = upstream_flights.stats()
+    refresh = weather_refresher.stats()
+    ipdb = ip_database.stats()
+    budgets = {name: governor.stats() for name, governor in GOVERNORS.items()}
+    admitted = admission.stats()
+    return [
+        ('lpa_cache_hits_total', 'counter', 'Cache hits',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('lpa_cache_misses_total', 'counter', 'Cache misses',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('lpa_cache_hit_ratio', 'gauge', 'Cache hits / lookups since start',
+         [({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()]),
+        ('lpa_cache_entries', 'gauge', 'Entries currently cached',
+         [({'cache': name}, stats['size']) for name, stats in caches.items()]),
+        ('lpa_cache_tier_hit_ratio', 'gauge', 'Cache hits / lookups per tier (l1 = process, l2 = host)',
+         [({'cache': name, 'tier': tier}, tier_stats['hit_ratio'])
+          for name, stats in caches.items() for tier, tier_stats in stats.get('tiers', {}).items()]),
+        ('lpa_shared_cache_errors_total', 'counter', 'Shared cache reads/writes that failed',
+         [({}, shared_cache.errors)] if shared_cache is not None else []),
+        ('lpa_upstream_circuit_open', 'gauge', '1 while an upstream circuit breaker is not closed',
+         [({'upstream': name}, int(client.breaker.state != 'closed')) for name, client in UPSTREAMS.items()]),
+        ('lpa_upstream_coalesced_total', 'counter', 'Upstream fetches avoided by single-flight',
+         [({}, flights['coalesced'])]),
+        ('lpa_upstream_in_flight', 'gauge', 'Distinct upstream fetches in progress',
+         [({}, flights['in_flight'])]),
+        ('lpa_upstream_budget_tokens', 'gauge', 'Quota tokens left per upstream quota window',
+         [({'quota': name, 'window': window}, bucket['tokens'])
+          for name, stats in budgets.items() for window, bucket in stats['buckets'].items()]),
+        ('lpa_upstream_budget_waiting', 'gauge', 'Calls queued for a quota token',
+         [({'quota': name}, stats['waiting']) for name, stats in budgets.items()]),
+        ('lpa_upstream_budget_requests_total', 'counter', 'Quota token requests by priority and result',
+         [({'quota': name, 'priority': priority, 'result': result}, stats[result][priority])
+          for name, stats in budgets.items() for result in ('granted', 'denied') for priority in PRIORITIES]),
+        ('lpa_admission_active', 'gauge', 'Requests holding an admission slot',
+         [({}, admitted['active'])]),
+        ('lpa_admission_queued', 'gauge', 'Requests waiting for an admission slot',
+         [({}, admitted['queued'])]),
+        ('lpa_admission_rejected_total', 'counter', 'Requests turned away by admission control',
+         [({'reason': reason}, count) for reason, count in admitted['rejected'].items()]),
+        ('lpa_weather_refreshed_total', 'counter', 'Background weather refreshes completed',
+         [({}, refresh['refreshed'])]),
+        ('lpa_weather_hot_cells', 'gauge', 'Grid cells currently considered hot',
+         [({}, refresh['hot_cells'])]),
+        ('lpa_ipdb_ranges', 'gauge', 'IP ranges in the loaded local database',
+         [({}, ipdb['ranges'])]),
+        ('lpa_ipdb_lookups_total', 'counter', 'Local IP database lookups by result',
+         [({'result': 'hit'}, ipdb['hits']), ({'result': 'miss'}, ipdb['misses'])]),
+        ('lpa_ipdb_reloads_total', 'counter', 'Times the local IP database was (re)loaded',
+         [({}, ipdb['reloads'])]),
+        ('lpa_snapshot_restored_entries', 'gauge', 'Cache entries restored from the boot snapshot',
+         [({'cache': name}, count) for name, count in snapshotter.restored.items()]),
+        ('lpa_snapshot_errors_total', 'counter', 'Cache snapshot reads/writes that failed',
+         [({}, snapshotter.errors)]),
+        ('lpa_capture_records_total', 'counter', 'Requests written to the traffic capture log',
+         [({}, capture_log.records)]),
+        ('lpa_capture_errors_total', 'counter', 'Traffic capture records that failed to write',
+         [({}, capture_log.errors)]),
+    ]
+
+METRIC_COLLECTORS.append(_runtime_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the in-process caches and upstream coalescing"""
+    return jsonify({
+        'success': True,
+        'weather': weather_cache.stats(),
+        'response': response_cache.stats(),
+        'geocode': geocode_cache.stats(),
+        'shared': shared_cache.stats() if shared_cache is not None else None,
+        'upstream_flights': upstream_flights.stats(),
+        'upstream_budget': {name: governor.stats() for name, governor in GOVERNORS.items()},
+        'weather_refresh': weather_refresher.stats(),
+        'ip_database': ip_database.stats()
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: always up once imported; "warm" once fresh weather is cached (e.g. from a snapshot).
+
+    ?require=warm answers 503 while cold, for probes that should hold traffic until then.
+    """
+    now = time.time()
+    fresh_cells = sum(1 for _, _, expires_at, _ in weather_cache.entries() if expires_at > now)
+    warm = fresh_cells > 0
+    response = jsonify({
+        'success': True,
+        'status': 'warm' if warm else 'cold',
+        'fresh_weather_cells': fresh_cells,
+        'geocodes': geocode_cache.stats()['size'],
+        'zones': len(_zone_offsets),
+        'admission': admission.stats(),
+        'snapshot': snapshotter.stats() if SNAPSHOT_FILE else None,
+    })
+    if request.args.get('require') == 'warm' and not warm:
+        response.status_code = 503
+    return response
+
+@app.route('/api/cities', methods=['GET'])
+def cities():
+    """Autocomplete for the manual city box, answered from the bundled gazetteer"""
+    query = request.args.get('q', '')[:100]
+    limit = min(max(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 1), AUTOCOMPLETE_LIMIT)
+    results, fuzzy = gazetteer.suggest(query, limit)
+    response = jsonify({'success': True, 'query': query, 'fuzzy': fuzzy, 'results': results})
+    response.headers['Cache-Control'] = 'public, max-age=86400'   # the gazetteer only changes on deploy
+    return response
+
+def quick_insight_payload():
+    moon = get_moon_phase()
+    now = datetime.now()
+    
+    return {
+        'success': True,
+        'moon_phase': moon['phase'],
+        'moon_emoji': moon['emoji'],
+        'current_time': now.strftime('%H:%M'),
+        'tip': get_random_productivity_tip()
+    }
 
 @app.route('/api/quick-insight', methods=['GET'])
 def quick_insight():
     """Get a quick insight without full analysis"""
     try:
-        moon = get_moon_phase()
-        now = datetime.now()
-        
-        return jsonify({
-            'success': True,
-            'moon_phase': moon['phase'],
-            'moon_emoji': moon['emoji'],
-            'current_time': now.strftime('%H:%M'),
-            'tip': get_random_productivity_tip()
-        })
+        return jsonify(quick_insight_payload())
     
     except Exception as e:
         return jsonify({
@@ -444,6 +3406,281 @@ def quick_insight():
             'error': str(e)
         }), 500
 
+# ══════════════════════════════════════════════════════════════════════════════
+# ASYNC (ASGI) SERVING MODE - uvicorn life_pattern_analyzer:asgi_app
+# ══════════════════════════════════════════════════════════════════════════════
+
+async def cache_io(cache, fn, *args, key=None):
+    """fn(*args) inline when cache can answer key from this process, else on a thread - its shared tier is SQLite"""
+    if cache.shared is None or (key is not None and cache.held(key)):
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def get_ip_location_async(ip=None):
+    location = local_ip_location(ip)
+    if location is not None:
+        return location
+    path = ip_api_path(ip)
+    try:
+        return parse_ip_location(await upstream_flights.do_async(('ip-api', path), upstream_get_async, 'ip-api', path))
+    except (UpstreamError, AttributeError) as e:
+        return ip_location_fallback(e)
+
+async def get_weather_async(lat, lon):
+    cell = weather_cell(lat, lon)
+    bucket = weather_bucket()[0]
+
+    weather = await cache_io(weather_cache, cached_weather, cell, bucket, key=(cell, bucket))
+    if weather is not None:
+        return weather
+
+    async def fill():
+        weather = await cache_io(weather_cache, unexpired_weather, (cell, bucket), key=(cell, bucket))
+        if weather is None:
+            weather = parse_forecast(await upstream_get_async('open-meteo', '/v1/forecast', params=forecast_params(*cell)))
+            await cache_io(weather_cache, weather_cache.set, (cell, bucket), weather, (bucket + 1) * WEATHER_UPDATE_MINUTES * 60)
+        return weather
+
+    try:
+        return dict(await upstream_flights.do_async(('weather', cell, bucket), fill))
+    except UpstreamError as e:
+        return await cache_io(weather_cache, weather_fallback, cell, bucket, e)
+
+async def geocode_city_async(name):
+    query, key = geocoding_query(name)
+    if gazetteer.resolve(name) is not None:
+        found, result = known_geocode(name)
+    else:
+        found, result = await cache_io(geocode_cache, known_geocode, name, key=key)
+    if found:
+        return result
+    data = await upstream_flights.do_async(('geocoding', key), upstream_get_async,
+                                           'geocoding', '/v1/search', geocoding_params(query))
+    return await cache_io(geocode_cache, remember_geocode, key, data)
+
+async def remote_place_async(lat, lon):
+    key = place_key(lat, lon)
+    found, place = await cache_io(geocode_cache, cached_geocode, key, key=key)
+    if found:
+        return place
+    GEOCODES.inc('remote')
+    try:
+        data = await upstream_flights.do_async(('nominatim', key), upstream_get_async,
+                                               'nominatim', '/reverse', nominatim_params(lat, lon))
+    except UpstreamError as e:
+        logger.warning('Reverse geocoding unavailable: %s', e)
+        return None
+    return await cache_io(geocode_cache, remember_place, key, data)
+
+async def resolve_location_async(body, ip=None):
+    kind = request_kind(body)
+    if kind == 'gps':
+        with stage('geocode'):
+            lat, lon = gps_point(body)
+            place = reverse_geocode(lat, lon) or {}
+            if not place.get('city') and not body.get('city'):
+                place = dict(place, **(await remote_place_async(lat, lon) or {}))
+            return gps_location(body, lat, lon, place)
+    with resolving(kind):
+        if kind == 'city':
+            return manual_location(body['city'], await geocode_city_async(body['city']))
+        return ip_sourced(await get_ip_location_async(ip))
+
+async def analyze_async(body, ip=None):
+    """/api/analyze without blocking the event loop while upstreams answer"""
+    location = await resolve_location_async(body, ip)
+    with stage('weather'):
+        weather = await get_weather_async(location['lat'], location['lon'])
+        if wants_hourly(body):
+            # Rare opt-in: reuse the sync cache and single-flight path on a thread
+            weather['hourly'] = await asyncio.to_thread(get_hourly_forecast, location['lat'], location['lon'])
+    return analysis_response(location, weather)
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def _send(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def _call_wsgi(scope, body, send):
+    """Serve any route without a native async handler through the Flask app on a thread"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def run():
+        result = app(_wsgi_environ(scope, body), start_response)
+        try:
+            return b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    content = await asyncio.to_thread(run)
+    await send({
+        'type': 'http.response.start',
+        'status': started['status'],
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started['headers']]
+    })
+    await send({'type': 'http.response.body', 'body': content})
+
+def scope_header(scope, header):
+    header = header.lower().encode()
+    return next((value.decode('latin-1') for name, value in scope.get('headers', [])
+                 if name.lower() == header), None)
+
+def scope_client_key(scope):
+    return client_key(scope_header(scope, API_KEY_HEADER), scope_client_ip(scope))
+
+def scope_client_ip(scope):
+    forwarded = ','.join(value.decode('latin-1') for name, value in scope.get('headers', [])
+                         if name.lower() == b'x-forwarded-for')
+    return client_ip(scope['client'][0] if scope.get('client') else None, forwarded)
+
+async def _asgi_analyze(scope, body):
+    try:
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        return 200, await analyze_async(data if isinstance(data, dict) else {}, scope_client_ip(scope))
+    except AnalysisError as e:
+        return e.status, {'success': False, 'error': str(e)}
+    except Exception as e:
+        logger.exception('Analysis failed')
+        return 500, {'success': False, 'error': str(e)}
+
+async def _asgi_quick_insight(scope, body):
+    try:
+        return 200, quick_insight_payload()
+    except Exception as e:
+        return 500, {'success': False, 'error': str(e)}
+
+ASYNC_ROUTES = {
+    ('POST', '/api/analyze'): _asgi_analyze,
+    ('GET', '/api/quick-insight'): _asgi_quick_insight,
+}
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: native async handlers for the hot endpoints, Flask for the rest"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if httpx is None:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': 'ASGI mode needs httpx: pip install -r requirements-extras.txt'})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if SNAPSHOT_FILE:
+                    await asyncio.to_thread(snapshotter.save)
+                for client in UPSTREAMS.values():
+                    if client._async_client is not None:
+                        await client._async_client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    body = await _read_body(receive)
+    handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await _call_wsgi(scope, body, send)
+        return
+
+    endpoint = handler.__name__.replace('_asgi_', '')
+    started = time.perf_counter()
+    if SNAPSHOT_FILE:
+        snapshotter.ensure_started()
+    # The clock starts before admission: time spent queued comes out of the same budget
+    deadline = start_deadline(scope_header(scope, DEADLINE_HEADER)) if endpoint == 'analyze' else None
+    admitted_at = None
+    if ADMISSION_MAX_CONCURRENT and endpoint in ADMISSION_ENDPOINTS:
+        try:
+            await admission.enter_async(scope_client_key(scope))
+        except Rejected as e:
+            await _send(send, e.status, app.json.dumps(e.payload()).encode(),
+                        headers=[(b'retry-after', str(e.retry_after).encode())])
+            REQUESTS_TOTAL.inc(endpoint, str(e.status))
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+            if deadline is not None:
+                request_deadline.reset(deadline)
+            return
+        admitted_at = time.perf_counter()
+    timings = {}
+    request_timings.set(timings)
+    REQUESTS_IN_FLIGHT.inc(endpoint)
+    capturing = CAPTURE_FILE and endpoint == 'analyze' and capture_log.start() is not None
+    try:
+        status, payload = await handler(scope, body)
+        if isinstance(payload, bytes):      # already serialized, e.g. from the response cache
+            content = payload
+        else:
+            with stage('serialize'):
+                content = app.json.dumps(payload).encode()
+        if capturing:
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                data = {}
+            capture_log.finish(data if isinstance(data, dict) else {}, status,
+                               json.loads(content) if isinstance(payload, bytes) else payload, started)
+        headers = [(b'server-timing', server_timing_header(timings).encode())] if timings else []
+        await _send(send, status, content, headers=headers)
+    finally:
+        REQUESTS_IN_FLIGHT.dec(endpoint)
+        if admitted_at is not None:
+            admission.leave(admitted_at)
+        if deadline is not None:
+            request_deadline.reset(deadline)
+    REQUESTS_TOTAL.inc(endpoint, str(status))
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+
 # ══════════════════════════════════════════════════════════════════════════════
 # STUNNING UI - Newspaper/Editorial Aesthetic with Bold Typography
 # ══════════════════════════════════════════════════════════════════════════════
@@ -1359,32 +4596,6 @@ async function getIPLocation() {
     }
 }
 
-// ── Get city name from GPS coords using reverse geocoding ──
-async function reverseGeocode(lat, lon) {
-    try {
-        const res  = await fetch(
-            `https://nominatim.openstreetmap.org/reverse?lat=${lat}&lon=${lon}&format=json&zoom=10&addressdetails=1`,
-            { headers: { 'Accept-Language': 'en', 'User-Agent': 'LifePatternAnalyzer/1.0' } }
-        );
-        const data = await res.json();
-        const addr = data.address || {};
-        const city =
-            addr.suburb       ||
-            addr.village      ||
-            addr.town         ||
-            addr.city         ||
-            addr.municipality ||
-            addr.county       ||
-            'Your Location';
-        const country  = addr.country || '';
-        const region   = addr.state   || addr.region || '';
-        const timezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
-        return { city, country, region, timezone };
-    } catch {
-        return { city: 'Your Location', country: '', region: '', timezone: Intl.DateTimeFormat().resolvedOptions().timeZone };
-    }
-}
-
 // ── Ask browser for GPS ──
 function getGPSLocation() {
     return new Promise((resolve, reject) => {
@@ -1416,10 +4627,12 @@ function showManualInput() {
                     GPS access was denied. Type your city for accurate weather & analysis.
                 </p>
                 <input id="city-input" type="text" placeholder="e.g. Calgary, London, Tokyo"
+                    list="city-suggestions" autocomplete="off"
                     style="width:100%; padding:14px 16px; border-radius:8px; border:1px solid #444;
                            background:#0a0a0a; color:#fafafa; font-size:16px; margin-bottom:16px;
                            outline:none; font-family:inherit;"
                 />
+                <datalist id="city-suggestions"></datalist>
                 <button onclick="submitCity()"
                     style="width:100%; padding:14px; border-radius:8px; border:none;
                            background:#ff4444; color:#fff; font-size:16px; cursor:pointer;
@@ -1438,12 +4651,33 @@ function showManualInput() {
         modal.querySelector('#city-input').addEventListener('keydown', e => {
             if (e.key === 'Enter') submitCity();
         });
+        modal.querySelector('#city-input').addEventListener('input', e => suggestCities(e.target.value));
     }
 
     document.getElementById('city-modal').style.display = 'flex';
     setTimeout(() => document.getElementById('city-input').focus(), 100);
 }
 
+// ── City suggestions from the server's gazetteer, as the user types ──
+let suggestTimer = null;
+function suggestCities(query) {
+    clearTimeout(suggestTimer);
+    if (query.trim().length < 2) return;
+    suggestTimer = setTimeout(async () => {
+        try {
+            const res  = await fetch('/api/cities?q=' + encodeURIComponent(query.trim()));
+            const data = await res.json();
+            const list = document.getElementById('city-suggestions');
+            list.innerHTML = '';
+            for (const c of data.results || []) {
+                const option = document.createElement('option');
+                option.value = [c.name, c.admin1, c.country].filter(Boolean).join(', ');
+                list.appendChild(option);
+            }
+        } catch { /* suggestions are a nicety - typing still works */ }
+    }, 120);
+}
+
 function closeModal() {
     const m = document.getElementById('city-modal');
     if (m) m.style.display = 'none';
@@ -1458,13 +4692,19 @@ async function submitCity() {
 }
 
 // ── Core analysis runner ──
-async function runAnalysis(payload) {
+async function runAnalysis(payload, retried = false) {
     try {
         const response = await fetch('/api/analyze', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
         });
+        // Busy or rate limited — wait as told, once, instead of hammering the server
+        const retryAfter = parseInt(response.headers.get('Retry-After') || '0', 10);
+        if ((response.status === 429 || response.status === 503) && !retried && retryAfter <= 30) {
+            await new Promise(resolve => setTimeout(resolve, Math.max(retryAfter, 1) * 1000));
+            return runAnalysis(payload, true);
+        }
         const data = await response.json();
 
         if (data.success) {
@@ -1507,12 +4747,8 @@ async function analyzeLife() {
         const position = await getGPSLocation();
         const { latitude: lat, longitude: lon } = position.coords;
 
-        // Step 2 — reverse geocode to get city name
-        const geo = await reverseGeocode(lat, lon);
-
-        // Step 3 — send GPS coords to backend
-        const label = geo.region ? geo.city + ', ' + geo.region : geo.city;
-        await runAnalysis({ lat, lon, city: label, country: geo.country, timezone: geo.timezone });
+        // Step 2 — send raw GPS coords and our timezone; the server names the place
+        await runAnalysis({ lat, lon, timezone: Intl.DateTimeFormat().resolvedOptions().timeZone });
 
     } catch (err) {
         // ② GPS denied — silently try IP location
@@ -1529,14 +4765,16 @@ async function analyzeLife() {
 
 function displayResults(data) {
     // Location & Weather
-    document.getElementById('location-city').textContent = data.location.city;
+    document.getElementById('location-city').textContent =
+        data.location.region ? `${data.location.city}, ${data.location.region}` : data.location.city;
     document.getElementById('location-details').textContent =
         `${data.location.country} • ${data.location.timezone} • ${data.location.source || ''}`;
     
     document.getElementById('weather-temp').textContent = 
         `${data.weather.temperature}°C`;
     document.getElementById('weather-condition').textContent = 
-        `${data.weather.condition} • ${data.weather.humidity}% humidity`;
+        `${data.weather.condition} • ${data.weather.humidity}% humidity` +
+        ((data.degraded || []).includes('weather') ? ' • estimated' : '');
     
     document.getElementById('moon-phase').textContent = 
         `${data.moon.emoji}`;
@@ -1623,7 +4861,8 @@ function displayTimeline(predictions) {
 
 // Auto-refresh every hour
 setInterval(() => {
-    if (document.getElementById('results').style.display === 'block') {
+    // Hidden tabs skip the refresh; the visible one keeps the numbers current
+    if (!document.hidden && document.getElementById('results').style.display === 'block') {
         analyzeLife();
     }
 }, 3600000); // 1 hour
@@ -0,0 +1,149 @@
+"""
+Open-loop load generator for /api/analyze.
+
+Sends requests on a fixed schedule at the target RPS, regardless of how fast
+the server answers, and measures latency from each request's *scheduled*
+start so a stalled server cannot hide its queueing (no coordinated omission).
+
+    python fake_upstream.py --latency lognormal:80,0.5 &
+    IP_API_URL=... gunicorn -w 4 life_pattern_analyzer:app &
+    python loadtest.py --url http://127.0.0.1:8000 --rps 200 --duration 30 --mix gps=6,city=3,ip=1
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CITY_NAMES = ['London', 'Paris', 'Berlin', 'New York', 'San Francisco', 'Calgary',
+              'Toronto', 'Tokyo', 'Sydney', 'Mumbai', 'São Paulo', 'Cape Town']
+
+def parse_mix(spec):
+    """'gps=6,city=3,ip=1' -> [(kind, weight), ...]"""
+    mix = []
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('gps', 'city', 'ip'):
+            raise ValueError(f'Unknown request kind: {kind}')
+        mix.append((kind, float(weight or 1)))
+    return mix
+
+def request_body(kind, rng, cells):
+    """One /api/analyze body; GPS coordinates are drawn from `cells` distinct weather cells"""
+    if kind == 'gps':
+        cell = rng.randrange(cells)
+        return {'lat': round(-60 + (cell // 360) * 0.1 + rng.random() * 0.05, 4),
+                'lon': round(-180 + (cell % 360) * 0.1 + rng.random() * 0.05, 4)}
+    if kind == 'city':
+        return {'city': rng.choice(CITY_NAMES)}
+    return {}
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+def run(url, rps, duration, mix, cells=200, max_concurrency=256, timeout=30, seed=1):
+    """Drive POST {url}/api/analyze open-loop and return a summary dict"""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix)
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+
+    lock = threading.Lock()
+    results = []    # (kind, status, latency_s, degraded)
+
+    def fire(scheduled, kind, body):
+        try:
+            r = session.post(f'{url}/api/analyze', json=body, timeout=timeout)
+            status = r.status_code
+            degraded = bool(r.ok and r.json().get('degraded'))
+        except requests.RequestException as e:
+            status, degraded = type(e).__name__, False
+        latency = time.perf_counter() - scheduled
+        with lock:
+            results.append((kind, status, latency, degraded))
+
+    total = int(rps * duration)
+    interval = 1 / rps
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            kind = rng.choices(kinds, weights)[0]
+            pool.submit(fire, scheduled, kind, request_body(kind, rng, cells))
+    elapsed = time.perf_counter() - start
+
+    # Only answered requests count towards latency and throughput: errors and fast 429/503
+    # sheds would otherwise flatter both under overload
+    ok_results = [r for r in results if r[1] == 200]
+    failed = [r for r in results if r[1] != 200]
+    by_status, by_kind = {}, {}
+    for kind, status, latency, _ in results:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+    for kind, _, latency, _ in ok_results:
+        by_kind.setdefault(kind, []).append(latency)
+
+    def summary(values):
+        if not values:
+            return {}
+        values = sorted(values)
+        return {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+
+    return {
+        'url': url,
+        'target_rps': rps,
+        'duration_s': duration,
+        'sent': len(results),
+        'elapsed_s': round(elapsed, 2),
+        'sent_rps': round(len(results) / elapsed, 1),
+        'achieved_rps': round(len(ok_results) / elapsed, 1),
+        'ok': len(ok_results),
+        'failed': len(failed),
+        'degraded': sum(1 for r in ok_results if r[3]),
+        'error_rate': round(len(failed) / len(results), 4) if results else 0.0,
+        'status': by_status,
+        'latency': summary([r[2] for r in ok_results]),
+        'failed_latency': summary([r[2] for r in failed]),
+        'by_kind': {kind: summary(values) for kind, values in by_kind.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator for /api/analyze')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--rps', type=float, default=50)
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--mix', default='gps=6,city=3,ip=1', help='weights per request kind')
+    parser.add_argument('--cells', type=int, default=200, help='distinct GPS weather cells to spread over')
+    parser.add_argument('--max-concurrency', type=int, default=256)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='FILE', help='also write the summary to FILE')
+    args = parser.parse_args()
+
+    summary = run(args.url.rstrip('/'), args.rps, args.duration, parse_mix(args.mix), args.cells,
+                  args.max_concurrency, args.timeout, args.seed)
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())